@@ -30,6 +30,18 @@ def cleanup(signum, frame):
     sys.exit(0)
 
 
+def dump_diagnostics(signum, frame):
+    """Write the recent events to the log."""
+    if _ADAPTER is not None:
+        _ADAPTER.diagnostics.dump('on SIGUSR1')
+
+
+def write_metrics(signum, frame):
+    """Write the metrics snapshot to metrics.json in the data dir."""
+    if _ADAPTER is not None:
+        _ADAPTER.write_metrics()
+
+
 if __name__ == '__main__':
     logging.basicConfig(
         level=logging.INFO,
@@ -47,6 +59,8 @@ if __name__ == '__main__':
         logging.info('Arguments list: %s', str(sys.argv))
         signal.signal(signal.SIGINT, cleanup)
         signal.signal(signal.SIGTERM, cleanup)
+        signal.signal(signal.SIGUSR1, dump_diagnostics)
+        signal.signal(signal.SIGUSR2, write_metrics)
         _ADAPTER = ConBeeAdapter(verbose=True)
         logging.debug('adapter created')
         # Wait until proxy stops running. this indicats that the gateway has shut down.
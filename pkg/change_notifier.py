@@ -0,0 +1,160 @@
+"""
+ConBee adapter for Mozilla IoT Gateway.
+Notifications of changed property values to the gateway. Small changes of
+noisy properties, e.g. power and temperature, can be held back by a policy
+per property type set in the notify_policies option. All properties
+changed while handling one event or command are sent together when it is
+done, each property once.
+"""
+import logging
+import time
+
+logger = logging.getLogger('conbee.notifier')
+
+# Policies per @type of the property, e.g.
+#   {'TemperatureProperty': {'deadband': 0.1, 'min_interval': 10, 'max_staleness': 300}}
+# deadband -- min change since the last sent value
+# min_interval -- min seconds between two notifications
+# max_staleness -- seconds after which a held change is sent anyway. None to hold it
+# None by default. Properties without policy are sent at once
+DEFAULT_POLICIES = {}
+
+
+class NotifyPolicy:
+    __slots__ = ('deadband', 'min_interval', 'max_staleness')
+
+    def __init__(self, deadband=0, min_interval=0, max_staleness=None):
+        self.deadband = deadband
+        self.min_interval = min_interval
+        self.max_staleness = max_staleness
+
+    def allows(self, value, sent_value, since_sent):
+        """ True if value may be sent now. since_sent -- seconds since sent_value was sent """
+        if since_sent < self.min_interval:
+            return False
+        if self.max_staleness is not None and since_sent >= self.max_staleness:
+            return True
+        return not within_deadband(value, sent_value, self.deadband)
+
+
+def within_deadband(value, sent_value, deadband):
+    if deadband <= 0 or isinstance(value, bool) or not isinstance(value, (int, float)) \
+            or not isinstance(sent_value, (int, float)):
+        return False
+    return abs(value - sent_value) < deadband
+
+
+IMMEDIATE = NotifyPolicy()
+
+
+class Sent:
+    """ Last value sent for one property and the timer of a held change """
+    __slots__ = ('value', 'at', 'timer')
+
+    def __init__(self):
+        self.value = None
+        self.at = float('-inf')
+        self.timer = None
+
+
+class ChangeNotifier:
+    """ Only changed and remove are safe to call from any thread """
+
+    def __init__(self, io, metrics, policies=None):
+        """
+        io -- the IoLoop sending the notifications
+        metrics -- Metrics for sent and held notifications
+        policies -- @type -> dict with NotifyPolicy arguments. Replaces the DEFAULT_POLICIES of the same type
+        """
+        self.io = io
+        self.metrics = metrics
+        config = dict(DEFAULT_POLICIES)
+        config.update(policies or {})
+        self.policies = {prop_type: NotifyPolicy(**args) for prop_type, args in config.items()}
+        self.sent = {}          # property -> Sent
+        self.pending = {}       # property -> None. Sent in the next flush, in order of change
+        self.flush_scheduled = False
+
+    def changed(self, prop):
+        """ The value of prop has changed. Safe to call from any thread """
+        if self.io.in_loop():
+            self._changed(prop)
+        else:
+            self.io.call_soon(self._changed, prop)
+
+    def policy(self, prop):
+        return self.policies.get(prop.description.get('@type'), IMMEDIATE)
+
+    def _changed(self, prop):
+        sent = self.sent.get(prop)
+        if sent is None:
+            sent = self.sent[prop] = Sent()
+        value = prop.get_value()
+        policy = self.policy(prop)
+        since_sent = time.monotonic() - sent.at
+        if policy.allows(value, sent.value, since_sent):
+            self.queue(prop)
+            return
+        self.metrics.count('notify.held')
+        if sent.timer is None:
+            delay = policy.min_interval - since_sent
+            if delay <= 0 and policy.max_staleness is not None:
+                delay = policy.max_staleness - since_sent
+            if delay > 0:
+                sent.timer = self.io.timers.call_later(delay, self.recheck, prop, name='notify')
+
+    def recheck(self, prop):
+        """ A held change of prop may be sent now """
+        sent = self.sent.get(prop)
+        if sent is None:
+            return
+        sent.timer = None
+        if prop.get_value() != sent.value:
+            self._changed(prop)
+
+    def queue(self, prop):
+        self.pending[prop] = None
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            self.io.loop.call_soon(self.flush)
+
+    def flush(self):
+        """ Send all pending notifications """
+        self.flush_scheduled = False
+        pending, self.pending = self.pending, {}
+        now = time.monotonic()
+        count = 0
+        for prop in pending:
+            if prop.device.stopped.is_set():
+                self.forget(prop)
+                continue
+            sent = self.sent[prop]
+            sent.value = prop.get_value()
+            sent.at = now
+            if sent.timer is not None:
+                sent.timer.cancel()
+                sent.timer = None
+            count += 1
+            try:
+                prop.device.notify_property_changed(prop)
+            except Exception as ex:
+                logger.exception('Notify %s failed %s', prop.name, ex)
+        self.metrics.count('notify.sent', count)
+        self.metrics.count('notify.flushes')
+
+    def remove(self, device):
+        """ Forget the properties of a removed device. Safe to call from any thread """
+        self.io.call_soon(self._remove, device)
+
+    def _remove(self, device):
+        for prop in device.properties.values():
+            self.pending.pop(prop, None)
+            self.forget(prop)
+
+    def forget(self, prop):
+        sent = self.sent.pop(prop, None)
+        if sent is not None and sent.timer is not None:
+            sent.timer.cancel()
+
+    def stats(self):
+        return {'properties': len(self.sent), 'pending': len(self.pending)}
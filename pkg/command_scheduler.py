@@ -0,0 +1,181 @@
+"""
+ConBee adapter for Mozilla IoT Gateway.
+Rate limited scheduler for all requests sent to deCONZ
+"""
+import collections
+import time
+
+from metrics import Metrics
+
+# Priority lanes. User initiated property changes are HIGH.
+# Background work as polling and fades are LOW
+HIGH = 0
+LOW = 1
+LANE_NAMES = ['high', 'low']
+
+
+class QueueFull(Exception):
+    """ The low priority lane is full. The request was not queued """
+
+
+class CommandScheduler:
+    """
+    Token bucket limiting the number of requests per second sent to deCONZ.
+    Requests in the high priority lane are always sent before the low
+    priority lane, so user commands are not delayed by a running scene or fade.
+
+    Requests with the same key, e.g. one device, run one at a time in the
+    order they were queued. A low request followed by a high request with
+    the same key is moved to the high lane. Requests with different keys
+    run in parallel in the executor. The low lane is bounded. When it is full new low
+    requests fail with QueueFull, so background work can not pile up.
+    Only to be used in the io loop.
+    """
+
+    def __init__(self, io, rate, burst, metrics=None, executor=None, limit=100, workers=None):
+        """
+        io -- the IoLoop running the REST calls
+        rate -- requests per second
+        burst -- requests that can be sent at once after an idle period
+        metrics -- Metrics for the wait time in queue
+        executor -- executor running the requests. The asyncio default executor if None
+        limit -- max queued requests per lane. The high lane only reports when it is above
+        workers -- max requests in the executor at once. Others wait in their lane. None for no max
+        """
+        self.io = io
+        self.executor = executor
+        self.metrics = metrics or Metrics()
+        self.wait_names = ['queue.{}.wait'.format(name) for name in LANE_NAMES]
+        self.full_names = ['queue.{}.full'.format(name) for name in LANE_NAMES]
+        self.rate = rate
+        self.burst = burst
+        self.limit = limit
+        self.workers = workers
+        self.in_flight = 0
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lanes = (collections.deque(), collections.deque())
+        self.active = set()     # keys with a request in a lane or in the executor
+        self.held = {}          # key -> deque of requests waiting for the running one
+        self.wakeup = None
+
+    def run(self, func, *args, priority=HIGH, key=None):
+        """
+        Queue the blocking func(*args). Returns an awaitable with its result.
+
+        priority -- HIGH or LOW
+        key -- requests with the same key are run in order, one at a time. None for no order
+        """
+        future = self.io.loop.create_future()
+        if self.depth(priority) >= self.limit:
+            self.metrics.count(self.full_names[priority])
+            if priority == LOW:
+                future.set_exception(QueueFull())
+                return future
+        request = (func, args, future, time.monotonic(), key, priority)
+        if key in self.active:
+            self.held.setdefault(key, collections.deque()).append(request)
+            if priority == HIGH:
+                self.promote(key)
+        else:
+            if key is not None:
+                self.active.add(key)
+            self.lanes[priority].append(request)
+        self.kick()
+        return future
+
+    def promote(self, key):
+        """ A high request waits for key. Move the low request queued for key to the high lane,
+            so the high request is not held behind the low lane """
+        lane = self.lanes[LOW]
+        for request in lane:
+            if request[4] == key:
+                lane.remove(request)
+                self.lanes[HIGH].append(request[:5] + (HIGH,))
+                self.metrics.count('queue.promoted')
+                return
+
+    def depth(self, priority):
+        """ Requests in the lane, also those held for their key """
+        held = sum(1 for requests in self.held.values() for request in requests if request[5] == priority)
+        return len(self.lanes[priority]) + held
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def kick(self):
+        """ Send queued requests while there are tokens and free workers left """
+        self.refill()
+        while self.workers is None or self.in_flight < self.workers:
+            priority = self.next_lane()
+            if priority is None:
+                return
+            if self.tokens < 1:
+                if self.wakeup is None:
+                    self.wakeup = self.io.timers.call_later((1 - self.tokens) / self.rate, self.wake)
+                return
+            func, args, future, queued, key, _ = self.lanes[priority].popleft()
+            if future.cancelled():
+                self.release(key)
+                continue
+            self.tokens -= 1
+            self.metrics.observe(self.wait_names[priority], time.monotonic() - queued)
+            self.in_flight += 1
+            inner = self.io.run_blocking(func, *args, executor=self.executor)
+            inner.add_done_callback(lambda f, future=future, key=key: self.done(f, future, key))
+
+    def done(self, inner, future, key):
+        self.in_flight -= 1
+        copy_result(inner, future)
+        self.release(key)
+        self.kick()
+
+    def release(self, key):
+        """ The request for key is done. Queue the next one held for key """
+        if key is None:
+            return
+        held = self.held.get(key)
+        if not held:
+            self.active.discard(key)
+            return
+        request = held.popleft()
+        # Highest priority still waiting for key
+        priority = min(waiting[5] for waiting in held) if held else request[5]
+        priority = min(priority, request[5])
+        self.lanes[priority].append(request[:5] + (priority,))
+        if not held:
+            del self.held[key]
+
+    def wake(self):
+        self.wakeup = None
+        self.kick()
+
+    def next_lane(self):
+        for priority, lane in enumerate(self.lanes):
+            if lane:
+                return priority
+        return None
+
+    def stats(self):
+        """ Queue depth and wait time in ms per lane """
+        stats = {}
+        for priority, name in enumerate(LANE_NAMES):
+            stats[name + '_depth'] = self.depth(priority)
+            stats[name + '_wait'] = self.metrics.histogram(self.wait_names[priority])
+        stats['active_keys'] = len(self.active)
+        stats['in_flight'] = self.in_flight
+        return stats
+
+
+def copy_result(inner, future):
+    """ Copy result of the executor future to the future returned by run """
+    if future.cancelled():
+        return
+    if inner.cancelled():
+        future.cancel()
+    elif inner.exception() is not None:
+        future.set_exception(inner.exception())
+    else:
+        future.set_result(inner.result())
@@ -1,11 +1,28 @@
 import logging
 from gateway_addon import Database
 
+logger = logging.getLogger('conbee.config')
+
 class Config(Database):
     def __init__(self, package_name):
         Database.__init__(self, package_name, None)
         self.temp_unit_celsius = True
         self.log_level = None
+        self.pool_size = 4
+        self.pool_idle_timeout = 30
+        self.event_driven = True
+        self.write_window_ms = 100
+        self.commands_per_second = 15
+        self.commands_burst = 10
+        self.queue_limit = 100
+        self.poll_min_interval = 2
+        self.poll_max_interval = 600
+        self.config_poll_interval = 3600
+        self.metrics_interval = 600
+        self.diagnostics_size = 2000
+        self.log_levels = ''
+        self.record_events = False
+        self.notify_policies = {}
         self.open()
         self.load()
 
@@ -13,15 +30,30 @@ class Config(Database):
         try:
             config = self.load_config()
             # config = json.loads(config.decode('utf-8'))
-            logging.info('config %s', config)
+            logger.info('config %s', config)
             if config['temperature'] == 'Celsius':
                 self.temp_unit_celsius = True
             else:
                 self.temp_unit_celsius = False
 
             self.log_level = config['log_level']
+            self.pool_size = int(config.get('pool_size', self.pool_size))
+            self.pool_idle_timeout = int(config.get('pool_idle_timeout', self.pool_idle_timeout))
+            self.event_driven = bool(config.get('event_driven', self.event_driven))
+            self.write_window_ms = int(config.get('write_window_ms', self.write_window_ms))
+            self.commands_per_second = int(config.get('commands_per_second', self.commands_per_second))
+            self.commands_burst = int(config.get('commands_burst', self.commands_burst))
+            self.queue_limit = int(config.get('queue_limit', self.queue_limit))
+            self.poll_min_interval = int(config.get('poll_min_interval', self.poll_min_interval))
+            self.poll_max_interval = int(config.get('poll_max_interval', self.poll_max_interval))
+            self.config_poll_interval = int(config.get('config_poll_interval', self.config_poll_interval))
+            self.metrics_interval = int(config.get('metrics_interval', self.metrics_interval))
+            self.diagnostics_size = int(config.get('diagnostics_size', self.diagnostics_size))
+            self.log_levels = config.get('log_levels', self.log_levels)
+            self.record_events = bool(config.get('record_events', self.record_events))
+            self.notify_policies = config.get('notify_policies', self.notify_policies)
         except Exception as ex:
-            logging.exception('Strange config', config)
+            logger.exception('Strange config', config)
 
     def conbee_url(self):
         url = None
@@ -29,10 +61,21 @@ class Config(Database):
 
         try:
             config = self.load_config()
-            logging.info('config %s', config)
+            logger.info('config %s', config)
             url = config['url']
             apikey = config['apikey']
         except Exception as ex:
-            logging.exception('Strange config', config)
+            logger.exception('Strange config', config)
 
         return url + '/api/' + apikey + '/'
+
+    def conbee_urls(self):
+        """ Urls of all gateways. The first is url and apikey, then the ones in gateways """
+        urls = [self.conbee_url()]
+        try:
+            config = self.load_config()
+            for gateway in config.get('gateways', []):
+                urls.append(gateway['url'] + '/api/' + gateway['apikey'] + '/')
+        except Exception as ex:
+            logger.exception('Strange gateways config %s', ex)
+        return urls
@@ -2,53 +2,107 @@
 
 import logging
 import threading
-import time
 
 from gateway_addon import Device
+from command_scheduler import HIGH, LOW
 from conbee_action import FadeAction
 from conbee_property import ConBeeBooleanProperty, \
-                            ConBeeBrightnessProperty, ConBeeColorTemperatureProperty, \
+                            ConBeeBrightnessProperty, ConBeeColorProperty, ConBeeColorTemperatureProperty, \
                             ConBeeLevelProperty, ConBeeMotionProperty, \
                             ConBeePushedProperty, ConBeeOnOffProperty, \
                             InstantaneousPowerProperty, ReachableProperty, \
                             TemperatureProperty
 
+logger = logging.getLogger('conbee.device')
+
 class ConBeeDevice(Device):
     """ConBee device type."""
-    def __init__(self, adapter, _id, dev_id, light):
+
+    # Keys in events handled by properties with the same name. section -> keys
+    EVENT_KEYS = {'config': ['battery', 'reachable'],
+                  'state': ['bri', 'ct', 'dark', 'on', 'power', 'presence', 'reachable', 'temperature']}
+    # Keys deCONZ changes smoothly with transitiontime. See fade
+    TRANSITION_KEYS = ('bri',)
+
+    def __init__(self, gateway, _id, dev_id, light):
         """
-        adapter -- the Adapter for this device
+        gateway -- the ConBeeGateway for this device
         _id -- ID of this device
         dev_id -- id on the conbee device
         light -- device info from deconz - ConBee request
         """
+        adapter = gateway.adapter
         Device.__init__(self, adapter, _id)
+        self.gateway = gateway
         self.etag = ''
-        self.poll_interval = 2
+        self.poll_interval = 2      # Start value. Adapted by the AdaptivePollPolicy
+        self.next_poll = 0
+        self.next_config_poll = 0
         self.reachable = None
+        self.stopped = threading.Event()    # Set when the device is removed or the adapter unloaded
 
         self.dev_id = dev_id
-        self.light = light
+        self.record = adapter.store.record(_id)
+        adapter.store.update(_id, light)
+        self.event_routes = {}
         if 'name' in light.keys() and len(light['name']) > 0:
             self.name = light['name']
         else:
             self.name = light['manufacturername']
-        self.description = light['manufacturername'] + ' / ' + light['type']
+        self.description = light.get('manufacturername', 'deCONZ') + ' / ' + light['type']
         self.add_property(ReachableProperty(self, self.is_reachable()))
 
-        self.active_poll = True
-        self.thread = threading.Thread(target=self.poll)
-        self.thread.daemon = True
-        self.thread.start()
-
     def add_property(self, property):
         self.properties[property.name] = property
 
+    def stop(self):
+        """ Stop running actions, e.g. fades """
+        self.stopped.set()
+
     def is_reachable(self):
         return self.get_state_value('reachable', False)
 
+    def fade(self, prop, target, duration, done=None):
+        """
+        Change prop to target in duration seconds. Keys in TRANSITION_KEYS are
+        sent as one command with transitiontime. Others are stepped by the ramp engine.
+        Devices that can not be set have no fade.
+
+        prop -- ConBeeProperty of this device
+        target -- property value at the end
+        done -- func() called when done or replaced by a new command
+        """
+        ramps = self.adapter.ramps
+        if prop.name not in self.TRANSITION_KEYS:
+            ramps.start(prop, target, duration, True, done)
+            return
+        target = max(target, prop.description.get('min', target))
+        ramps.start(prop, target, duration, False, done)
+        dvalue = prop.prop2dev_value(target)
+        self.set_state(self.dev_id, prop.description['type'], prop.name, dvalue,
+                       priority=LOW, transition=int(round(duration * 10)))
+        prop.apply_device_value(dvalue)
+
     def get_state_value(self, key, default=None):
-        return self.light['state'].get(key, default)
+        return self.record.get('state', key, default)
+
+    def build_event_routes(self):
+        """ Map keys in events to the properties handling them. Done at pairing time """
+        self.event_routes = {}
+        for section, keys in self.EVENT_KEYS.items():
+            routes = {}
+            for key in keys:
+                prop = self.find_property(key)
+                if prop is not None:
+                    routes[key] = prop
+            self.event_routes[section] = routes
+
+    def update_properties(self):
+        """ Set all properties from the stored state. Done when the routes are built.
+            Later polls only update the properties of changed keys """
+        self.check_if_reachable()
+        for prop in self.properties.values():
+            prop.update()
 
     def event_action(self, event):
         # {'e': 'changed', 'id': '2', 'state': {'lastupdated': '2018-12-06T20:50:28', 'power': 40}, 't': 'event', 'r': 'sensors'}
@@ -61,62 +115,58 @@ class ConBeeDevice(Device):
         # {'id': '5', 'r': 'sensors', 'state': {'presence': True, 'dark': True, 'lastupdated': '2018-12-09T09:41:52'}, 'e': 'changed', 't': 'event'}
         # {'id': '5', 'r': 'sensors', 'e': 'changed', 'config': {'group': '58842', 'alert': 'none', 'duration': 60, 'battery': 60, 'reachable': True, 'delay': 60, 'on': True}, 't': 'event'}
         handled = False
-        if 'config' in event:
-            for prop in ['battery', 'reachable']:
-                found = self.update_property_from_event(event['config'], prop)
-                if found == True:
-                    handled = True
-        if 'state' in event:
-            for prop in ['bri', 'ct', 'dark', 'on', 'power', 'reachable', 'temperature']:
-                found = self.update_property_from_event(event['state'], prop)
-                if found == True:
+        for section, routes in self.event_routes.items():
+            values = event.get(section)
+            if values is None:
+                continue
+            self.adapter.store.update_section(self.record, section, values)
+            for key, val in values.items():
+                prop = routes.get(key)
+                if prop is not None:
+                    prop.set_device_value(val)
                     handled = True
         if handled == False:
-            logging.info('Unhandled event. event: %s', event)
+            logger.debug('Unhandled event. event: %s', event)
         return handled
 
-
     def check_if_reachable(self):
-        curr_reachable = self.light['state'].get('reachable')
+        curr_reachable = self.record.get('state', 'reachable')
         if curr_reachable == None:
-            curr_reachable = self.light['config'].get('reachable')
+            curr_reachable = self.record.get('config', 'reachable')
         if curr_reachable == None:
-            logging.error('check_if_reach: %s', curr_reachable)
+            logger.error('check_if_reach: %s', curr_reachable)
         self.set_reachable(curr_reachable)
 
     def set_reachable(self, status):
         status = bool(status)
         if self.reachable != status:
-            logging.info('Device: %s is now reachable: %s', self.name, status)
+            logger.info('Device: %s is now reachable: %s', self.name, status)
             self.reachable = status
             self.connected_notify(status)
 
-    def update_property_from_event(self, state_config, prop):
-        # Return True if this property exist in event
-        if prop in state_config:
-            val = state_config[prop]
-            property = self.find_property(prop)
-            property.set_device_value(val)
-            return True
-        return False
+    def poll_update(self, light, sections=None):
+        """
+        Update device from polled data. Called by the gateway poller
+        when the etag of the device has changed.
+        Returns list of changed (section, key)
 
-    def poll(self):
-        """ Poll device for changes."""
-        logging.info('poll START for %s', self.name)
-        while self.active_poll:
-            try:
-                time.sleep(self.poll_interval)
-                self.light = self.get_dev_data()
-                if self.light.get('etag') != self.etag:
-                    logging.debug('Changed etag %s for device %s - %s', self.etag, self.name, self.light)
-                    self.etag = self.light.get('etag')
-                    self.check_if_reachable()
-                for prop in self.properties.values():
-                    prop.update()
-            except Exception as ex:
-                logging.exception('Exception %s', ex)
-                continue
-        logging.info('POLL stop for: %s', self.name)
+        light -- device info from deconz - ConBee request
+        sections -- sections to update, e.g. ['state']. All if None
+        """
+        logger.debug('Changed etag %s for device %s - %s', self.etag, self.name, light)
+        changed = self.adapter.store.update(self.id, light, sections)
+        self.etag = light.get('etag')
+        if not changed:
+            return changed
+        self.check_if_reachable()
+        props = set()
+        for section, key in changed:
+            prop = self.event_routes.get(section, {}).get(key)
+            if prop is not None:
+                props.add(prop)
+        for prop in props:
+            prop.update()
+        return changed
 
     @staticmethod
     def property_path_value(device, path, prop, name):
@@ -127,22 +177,38 @@ class ConBeeDevice(Device):
         path - 'config' or 'state'
         device -- device of the light
         """
-        value = device.light[path][name]
+        value = device.record.get(path, name)
+        if value is None:
+            return None
         if 'type' in prop.description and prop.description['type'] == 'boolean':
             value = bool(value)
         return value
 
 class ConBeeAbstractLight(ConBeeDevice):
-    def __init__(self, adapter, _id, dev_id, light):
-        """ adapter -- the Adapter managing this device
+    def __init__(self, gateway, _id, dev_id, light):
+        """ gateway -- the ConBeeGateway managing this device
             _id     -- ID of this device
             dev_id  -- id on the conbee device
             light   -- device info from ConBee request """
-        ConBeeDevice.__init__(self, adapter, _id, dev_id, light)
+        ConBeeDevice.__init__(self, gateway, _id, dev_id, light)
         self._context = 'https://iot.mozilla.org/schemas'
 
-    def get_dev_data(self):
-        return self.adapter.rest.getLight(self.dev_id)
+    def set_state(self, dev_id, _type, key, value, priority=HIGH, transition=None):
+        """
+        Send new state to the light. Same arguments as DeconzRestApi.set_state.
+        Values are held and merged by the gateway writer before they are sent.
+        priority -- lane in the CommandScheduler
+        transition -- deCONZ transitiontime in 1/10 s
+        """
+        self.gateway.writer.write(('lights', dev_id), key, value, self.send_state_values, priority, transition)
+
+    def send_state_values(self, values):
+        """ values -- dict with keys and values """
+        self.gateway.rest.set_state_values(self.dev_id, values)
+
+    def stop(self):
+        super().stop()
+        self.gateway.writer.discard(('lights', self.dev_id))
 
     def is_dimmable(self):
         """
@@ -155,113 +221,233 @@ class ConBeeAbstractLight(ConBeeDevice):
 
 class ConBee_0010_OnOff_plug_in_unit(ConBeeAbstractLight):
     """ConBee switch type."""
-    def __init__(self, adapter, _id, dev_id, light):
-        """ adapter -- the Adapter managing this device
+    def __init__(self, gateway, _id, dev_id, light):
+        """ gateway -- the ConBeeGateway managing this device
             _id -- ID of this device
             dev_id -- id on the conbee device
             light -- device info from ConBee request """
-        ConBeeAbstractLight.__init__(self, adapter, _id, dev_id, light)
+        ConBeeAbstractLight.__init__(self, gateway, _id, dev_id, light)
         self._type = ['OnOffSwitch']
         self.type = 'onOffSwitch'
-        logging.info('ConBee_0010_OnOff_plug_in_unit.__init__ %s', light)
+        logger.info('ConBee_0010_OnOff_plug_in_unit.__init__ %s', light)
         self.add_property(ConBeeOnOffProperty(self,
                                               lambda d, p : self.property_path_value(self, 'state', p, 'on'),
-                                              self.adapter.rest.set_state))
+                                              self.set_state))
         self.add_property(InstantaneousPowerProperty(self, 'Power', 'power', None))
 
-        logging.info('Added: ConBee_0010_OnOff_plug_in_unit')
+        logger.info('Added: ConBee_0010_OnOff_plug_in_unit')
 
 class ConBee_0100_Dimmable_light(ConBeeAbstractLight):
-    def __init__(self, adapter, _id, dev_id, light):
+    def __init__(self, gateway, _id, dev_id, light):
         """
-        adapter -- the Adapter managing this device
+        gateway -- the ConBeeGateway managing this device
         _id -- ID of this device
         dev_id -- id on the conbee device
         light -- device info from ConBee request
         """
-        ConBeeAbstractLight.__init__(self, adapter, _id, dev_id, light)
+        ConBeeAbstractLight.__init__(self, gateway, _id, dev_id, light)
         self._type = ['Light']
         self.type = 'dimmableColorLight'
         self.add_property(ConBeeOnOffProperty(self, lambda d, p : self.property_path_value(self, 'state', p, 'on'),
-                                              self.adapter.rest.set_state))
+                                              self.set_state))
         self.add_property(ConBeeBrightnessProperty(self, 'Brightness', 'bri',
                                                    lambda d, p : self.property_path_value(self, 'state', p, 'bri'),
-                                                   self.adapter.rest.set_state, 2.55, min=10))
-        logging.debug('Done ConBee_0100_Dimmable_light %s', str(self.as_dict()))
+                                                   self.set_state, 2.55, min=10))
+        logger.debug('Done ConBee_0100_Dimmable_light %s', str(self.as_dict()))
 
 class ConBee_0220_Color_temperature_light(ConBeeAbstractLight):
-    def __init__(self, adapter, _id, dev_id, light):
+    def __init__(self, gateway, _id, dev_id, light):
         """
-        adapter -- the Adapter managing this device
+        gateway -- the ConBeeGateway managing this device
         _id -- ID of this device
         dev_id -- id on the conbee device
         light -- device info from ConBee request
         """
-        ConBeeAbstractLight.__init__(self, adapter, _id, dev_id, light)
+        ConBeeAbstractLight.__init__(self, gateway, _id, dev_id, light)
         self._type = ['ColorControl', 'Light']
         self.type = 'dimmableColorLight'
-        logging.info('ConBee_0220_Color_temperature_light.__init__ %s', light)
+        logger.info('ConBee_0220_Color_temperature_light.__init__ %s', light)
 
-        self.add_property(ConBeeOnOffProperty(self, lambda d, p : self.property_path_value(self, 'state', p, 'on'), self.adapter.rest.set_state))
+        self.add_property(ConBeeOnOffProperty(self, lambda d, p : self.property_path_value(self, 'state', p, 'on'), self.set_state))
         if self.is_dimmable():
             self.add_property(ConBeeBrightnessProperty(self, 'Brightness', 'bri',
                                                        lambda d, p : self.property_path_value(self, 'state', p, 'bri'),
-                                                       self.adapter.rest.set_state, 2.55, min=10))
+                                                       self.set_state, 2.55, min=10))
         if light['state'].get('ct'):
             desc = {"label": "ColorTemp", "type": "number", "unit": "kelvin", "min": light['ctmin'],
                     "max": light['ctmax'], "description": "property descripton", "@type": "ColorTemperatureProperty"}
-            logging.info("Add ColorTemp property %s", desc)
+            logger.info("Add ColorTemp property %s", desc)
             self.add_property(ConBeeColorTemperatureProperty(self, light['ctmin'], light['ctmax'],
                                                              lambda d, p : self.property_path_value(self, 'state', p, 'ct'),
-                                                             self.adapter.rest.set_state))
-        logging.debug('Done ConBee_0220_Color_temperature_light %s', str(self.as_dict()))
+                                                             self.set_state))
+        logger.debug('Done ConBee_0220_Color_temperature_light %s', str(self.as_dict()))
 
     def perform_action(self, action):
-        logging.info('perform_action %s, Dict:%s', action.name, action.as_dict())
+        logger.info('perform_action %s, Dict:%s', action.name, action.as_dict())
         if action.name == 'fade_off':
             prop = self.find_property('bri')
-            logging.info('bri %s', prop.as_dict())
-            FadeAction(self, prop).start()
+            logger.info('bri %s', prop.as_dict())
+            FadeAction(action.id, self, prop, action.input).start()
+
+class ConBee_0210_Extended_color_light(ConBee_0220_Color_temperature_light):
+    """ Color light and Extended color light. Color temperature if the light has ct """
+
+    # Keys in events of the color property
+    COLOR_KEYS = ('xy', 'hue', 'sat')
+
+    def __init__(self, gateway, _id, dev_id, light):
+        """
+        gateway -- the ConBeeGateway managing this device
+        _id -- ID of this device
+        dev_id -- id on the conbee device
+        light -- device info from ConBee request
+        """
+        ConBee_0220_Color_temperature_light.__init__(self, gateway, _id, dev_id, light)
+        self.add_property(ConBeeColorProperty(self, lambda d, p : self.color_value(), self.set_state))
+        logger.debug('Done ConBee_0210_Extended_color_light %s', str(self.as_dict()))
+
+    def color_value(self):
+        """ ('hs', hue, sat) or ('xy', x, y) as in colormode. None if not known """
+        hue = self.get_state_value('hue')
+        sat = self.get_state_value('sat')
+        if self.get_state_value('colormode') == 'hs' and hue is not None and sat is not None:
+            return ('hs', hue, sat)
+        xy = self.get_state_value('xy')
+        if xy:
+            return ('xy', xy[0], xy[1])
+        if hue is not None and sat is not None:
+            return ('hs', hue, sat)
+        return None
+
+    def build_event_routes(self):
+        super().build_event_routes()
+        color = self.find_property('color')
+        for key in self.COLOR_KEYS:
+            self.event_routes['state'][key] = color
+
+class ConBeeLightGroup(ConBeeDevice):
+    """
+    deCONZ group of lights. A change is sent as one PUT to the group action
+    which deCONZ sends as one Zigbee groupcast to all lights in the group.
+    """
+
+    def __init__(self, gateway, _id, dev_id, group):
+        """
+        gateway -- the ConBeeGateway managing this device
+        _id -- ID of this device
+        dev_id -- group id on the conbee device
+        group -- group info from ConBee request
+        """
+        ConBeeDevice.__init__(self, gateway, _id, dev_id, group)
+        self._context = 'https://iot.mozilla.org/schemas'
+        self._type = ['Light']
+        self.type = 'dimmableColorLight'
+        logger.info('ConBeeLightGroup.__init__ %s', group)
+        self.members = group.get('lights', [])
+        action = group.get('action', {})
+        self.add_property(ConBeeOnOffProperty(self, lambda d, p : bool(self.get_state_value('any_on', False)),
+                                              self.set_state))
+        if 'bri' in action:
+            self.add_property(ConBeeBrightnessProperty(self, 'Brightness', 'bri',
+                                                       lambda d, p : self.record.get('action', 'bri'),
+                                                       self.set_state, 2.55, min=10))
+        if 'ct' in action:
+            self.add_property(ConBeeColorTemperatureProperty(self, group.get('ctmin', 153), group.get('ctmax', 500),
+                                                             lambda d, p : self.record.get('action', 'ct'),
+                                                             self.set_state))
+        logger.debug('Done ConBeeLightGroup %s', str(self.as_dict()))
+
+    def is_reachable(self):
+        return True
+
+    def check_if_reachable(self):
+        self.set_reachable(True)
+
+    def build_event_routes(self):
+        """ Map keys in polled data to the properties handling them. Events are handled by event_action """
+        routes = {'state': {'any_on': self.find_property('on')}, 'action': {}}
+        for key in ['bri', 'ct']:
+            if self.find_property(key) is not None:
+                routes['action'][key] = self.find_property(key)
+        self.event_routes = routes
+
+    def event_action(self, event):
+        # {'e': 'changed', 'id': '1', 'r': 'groups', 't': 'event', 'state': {'all_on': False, 'any_on': True}}
+        handled = False
+        if 'state' in event and 'any_on' in event['state']:
+            self.adapter.store.update_section(self.record, 'state', event['state'])
+            self.find_property('on').apply_device_value(bool(event['state']['any_on']))
+            handled = True
+        if 'action' in event:
+            for prop in ['bri', 'ct']:
+                if prop in event['action'] and self.find_property(prop) is not None:
+                    self.find_property(prop).apply_device_value(event['action'][prop])
+                    handled = True
+        if handled == False:
+            logger.debug('Unhandled group event. event: %s', event)
+        return handled
+
+    def set_state(self, dev_id, _type, key, value, priority=HIGH, transition=None):
+        """ Same arguments as DeconzRestApi.set_state. Merged by the gateway writer """
+        self.gateway.writer.write(('groups', dev_id), key, value, self.send_state_values, priority, transition)
+
+    def send_state_values(self, values):
+        """ values -- dict with keys and values """
+        if self.gateway.rest.set_group_action(self.dev_id, values):
+            self.adapter.io.call_soon(self.update_members, values)
+
+    def stop(self):
+        super().stop()
+        self.gateway.writer.discard(('groups', self.dev_id))
+
+    def update_members(self, values):
+        """ Update the lights in the group from the group command. Nothing is sent to them """
+        for light_id in self.members:
+            device = self.gateway.get_device_from_mapping('lights', light_id)
+            if device is None:
+                continue
+            self.adapter.store.update_section(device.record, 'state', values)
+            for key, value in values.items():
+                prop = device.find_property(key)
+                if prop is not None:
+                    prop.apply_device_value(value)
 
 class ConBeeAbstractSensor(ConBeeDevice):
     """ConBee sensor type."""
 
-    def __init__(self, adapter, _id, dev_id, light):
+    def __init__(self, gateway, _id, dev_id, light):
         """
         Initialize the object.
 
-        adapter -- the Adapter managing this device
+        gateway -- the ConBeeGateway managing this device
         _id -- ID of this device
         dev_id -- id on the conbee device
         light -- device info from ConBee request
         """
-        ConBeeDevice.__init__(self, adapter, _id, dev_id, light)
-
-    def get_dev_data(self):
-        return self.adapter.rest.get_sensor(self.dev_id)
+        ConBeeDevice.__init__(self, gateway, _id, dev_id, light)
 
 class ConBeeZHAPresenceSensor(ConBeeAbstractSensor):
     """ConBee sensor type."""
 
-    def __init__(self, adapter, _id, dev_id, light):
+    def __init__(self, gateway, _id, dev_id, light):
         """
-        adapter -- the Adapter managing this device
+        gateway -- the ConBeeGateway managing this device
         _id -- ID of this device
         dev_id -- id on the conbee device
         light -- device info from ConBee request
         """
-        ConBeeAbstractSensor.__init__(self, adapter, _id, dev_id, light)
+        ConBeeAbstractSensor.__init__(self, gateway, _id, dev_id, light)
         self._type = ['MotionSensor']
         self._context = 'https://iot.mozilla.org/schemas'
 
-        logging.info('ConBeeZHAPresenceSensor.__init__ %s', light)
+        logger.info('ConBeeZHAPresenceSensor.__init__ %s', light)
         self.add_property(ConBeeMotionProperty(self, 'Motion', 'presence',
                                                lambda d, p : self.get_state_value('presence', False)))
         self.add_property(ConBeeLevelProperty(self, 'Battery', 'battery',
                                               lambda d, p : self.property_path_value(self, 'config', p, 'battery')))
         self.add_property(ConBeeBooleanProperty(self, 'Dark', 'dark', False))
         #self.add_property(ReachableProperty(self))
-        logging.info('Added ConBeeSensor %s', str(self.as_dict()))
+        logger.info('Added ConBeeSensor %s', str(self.as_dict()))
 
 class ConBeeDimmerButton(ConBeeAbstractSensor):
     """
@@ -270,24 +456,24 @@ class ConBeeDimmerButton(ConBeeAbstractSensor):
     events: dimmer
     """
 
-    def __init__(self, adapter, _id, dev_id, light):
+    def __init__(self, gateway, _id, dev_id, light):
         """
         Initialize the object.
 
-        adapter -- the Adapter managing this device
+        gateway -- the ConBeeGateway managing this device
         _id -- ID of this device
         dev_id -- id on the conbee device
         light -- device info from ConBee request
         """
-        ConBeeAbstractSensor.__init__(self, adapter, _id, dev_id, light)
+        ConBeeAbstractSensor.__init__(self, gateway, _id, dev_id, light)
         self._type = ['MultiLevelSwitch']
         self._context = 'https://iot.mozilla.org/schemas'
 
-        logging.info('ConBeeDimmerButton.__init__ %s', light)
+        logger.info('ConBeeDimmerButton.__init__ %s', light)
         self.add_property(ConBeeBrightnessProperty(self, 'Brightness', 'level'))
         self.add_property(ConBeeLevelProperty(self, 'Battery', 'battery', lambda d, p : self.property_path_value(self, 'config', p, 'battery')))
 
-        logging.info('Added ConBeeDimmerButton %s', str(self.as_dict()))
+        logger.info('Added ConBeeDimmerButton %s', str(self.as_dict()))
 
     def event_action(self, event):
         # "state":{"buttonevent":2002,"lastupdated":"2018-12-02T22:25:34"},
@@ -320,28 +506,25 @@ class ConBeeDimmerButton(ConBeeAbstractSensor):
 class ConBeeZHATemperatureSensor(ConBeeAbstractSensor):
     """ConBee sensor type."""
 
-    def __init__(self, adapter, _id, dev_id, light, unit_celsius):
+    def __init__(self, gateway, _id, dev_id, light, unit_celsius):
         """
-        adapter -- the Adapter managing this device
+        gateway -- the ConBeeGateway managing this device
         _id -- ID of this device
         dev_id -- id on the conbee device
         light -- device info from ConBee request
         """
-        ConBeeAbstractSensor.__init__(self, adapter, _id, dev_id, light)
+        ConBeeAbstractSensor.__init__(self, gateway, _id, dev_id, light)
         self._type = ['TemperatureSensor']
         self._context = 'https://iot.mozilla.org/schemas'
 
         # every 5 minutes
         self.poll_interval = 300
 
-        logging.info('ConBeeTemperatureSensor.__init__ %s', light)
+        logger.info('ConBeeTemperatureSensor.__init__ %s', light)
         self.add_property(TemperatureProperty(self, 'Temperature', 'temperature',
                                                     lambda d, p : self.get_state_value('temperature', 0), unit_celsius))
         #self.add_property(ConBeeLevelProperty(self, 'Battery', self.property_config_value))
         self.add_property(ConBeeLevelProperty(self, 'Battery', 'battery',
                                               lambda d, p : self.property_path_value(self, 'config', p, 'battery')))
 
-        logging.info('Added ConBeeSensor %s', str(self.as_dict()))
-
-    def get_dev_data(self):
-        return self.adapter.rest.get_sensor(self.dev_id)
+        logger.info('Added ConBeeSensor %s', str(self.as_dict()))
@@ -0,0 +1,425 @@
+"""
+ConBee adapter for Mozilla IoT Gateway.
+One deCONZ gateway. Each gateway has its own REST connection pool and
+threads, request scheduler, websocket, poller and device mapping, so a
+slow gateway does not stall the others.
+"""
+import logging
+import os
+import time
+
+from command_scheduler import CommandScheduler, LOW
+from conbee_poller import ConBeePoller
+from poll_policy import AdaptivePollPolicy
+from conbee_writer import WriteCoalescer
+from conbee_device import ConBeeDimmerButton, ConBeeZHATemperatureSensor, \
+                          ConBeeZHAPresenceSensor, ConBee_0010_OnOff_plug_in_unit, \
+                          ConBee_0100_Dimmable_light, ConBee_0210_Extended_color_light, \
+                          ConBee_0220_Color_temperature_light, ConBeeLightGroup
+from deconz_rest_api import DeconzRestApi
+from inventory import Inventory, RESOURCES
+from ws_client import WsClient, MIN_BACKOFF, MAX_BACKOFF
+from ws_recorder import WsRecorder
+
+logger = logging.getLogger('conbee.gateway')
+
+
+class ConBeeGateway:
+    """
+    Devices of one deCONZ gateway. Device ids of all but the first gateway
+    are prefixed, so the same group id on two gateways gives two devices.
+    """
+
+    def __init__(self, adapter, index, conbee_url):
+        """
+        adapter -- the ConBeeAdapter
+        index -- 0 for the first gateway in the config
+        conbee_url -- url to the REST API including api key
+        """
+        self.adapter = adapter
+        self.index = index
+        self.name = 'deCONZ' if index == 0 else 'deCONZ-{}'.format(index + 1)
+        self.prefix = '' if index == 0 else 'conbee{}-'.format(index + 1)
+        self.conbee_url = conbee_url
+        self.io = adapter.io
+        self.metrics = adapter.metrics
+        config = adapter._config
+        self.executor = self.io.new_executor(config.pool_size, 'conbee-rest-{}'.format(index + 1))
+        self.scheduler = CommandScheduler(self.io, config.commands_per_second, config.commands_burst,
+                                          self.metrics, self.executor, config.queue_limit, config.pool_size)
+        self.writer = WriteCoalescer(self.io, self.scheduler, config.write_window_ms / 1000)
+        self.rest = DeconzRestApi(conbee_url, config.pool_size, config.pool_idle_timeout, self.metrics)
+        self.ws = None
+        self.device_mapping = {}   # Map between (ligt/sensor, id) and device id
+        self.routes = {}           # Map between (ligt/sensor, id) and device. See build_routes
+        self.unsupported = set()   # (ligt/sensor, id) not added. Not added again when seen by the poller
+        self.poller = ConBeePoller(self, config.poll_min_interval,
+                                   AdaptivePollPolicy(self.metrics, config.poll_min_interval,
+                                                      config.poll_max_interval, config.config_poll_interval))
+        file_name = 'inventory.json' if index == 0 else 'inventory-{}.json'.format(index + 1)
+        self.inventory = Inventory(os.path.join(adapter.data_dir(), file_name))
+        self.recorder = None
+        if config.record_events:
+            file_name = 'events.rec' if index == 0 else 'events-{}.rec'.format(index + 1)
+            self.recorder = WsRecorder(self.io, os.path.join(adapter.data_dir(), file_name))
+        self.sync_task = None
+
+    def get_uid(self, light_sensor):
+        uid = light_sensor['uniqueid']
+        # logger.info('uid: %s c: %s len: %s', uid, uid.count(':'), len(uid))
+        if uid.count(':') == 7 and len(uid) >= 24:
+            return self.prefix + uid[:23]
+        return self.prefix + uid
+
+    def get_group_uid(self, group_id):
+        # Groups have no uniqueid
+        return '{}conbee-group-{}'.format(self.prefix, group_id)
+
+    def create_light_device(self, uid, conbee_id, light):
+        if light['type'] == 'On/Off plug-in unit':
+            return ConBee_0010_OnOff_plug_in_unit(self, uid, conbee_id, light)
+        if light['type'] == 'Dimmable light':
+            return ConBee_0100_Dimmable_light(self, uid, conbee_id, light)
+        if light['type'] == 'Color temperature light':
+            return ConBee_0220_Color_temperature_light(self, uid, conbee_id, light)
+        if light['type'] in ('Color light', 'Extended color light'):
+            return ConBee_0210_Extended_color_light(self, uid, conbee_id, light)
+        return None
+
+    """ Add device to map of light/sensors """
+    def add_device_mapping(self, light_sensor, ix, uid):
+        self.device_mapping[(light_sensor, str(ix))] = uid
+
+    def get_device_from_mapping(self, light_sensor, ix):
+        return self.routes.get((light_sensor, str(ix)))
+
+    def build_routes(self):
+        """
+        Build the routing index used for events and polled data.
+        (light/sensor, id) -> device. Each device also builds the map
+        from event keys to its properties.
+        """
+        routes = {}
+        for key, uid in self.device_mapping.items():
+            device = self.adapter.get_device(uid)
+            if device is not None:
+                device.build_event_routes()
+                device.update_properties()
+                routes[key] = device
+        self.routes = routes
+
+    def add_route(self, key):
+        """ Add the route for one (light/sensor, id) after it is added to device_mapping """
+        device = self.adapter.get_device(self.device_mapping.get(key))
+        if device is not None:
+            device.build_event_routes()
+            device.update_properties()
+            self.routes[key] = device
+
+    def inventory_event(self, event):
+        """
+        Update the inventory from a websocket event. Runs in the io loop.
+        Returns True if the event was added, deleted or scene-called.
+
+        event -- e.g. {'e': 'added', 'r': 'lights', 'id': '5', 'light': {...}}
+                      {'e': 'deleted', 'r': 'sensors', 'id': '7'}
+                      {'e': 'scene-called', 'r': 'scenes', 'gid': '1', 'scid': '2'}
+        """
+        kind = event.get('e')
+        light_sensor = event.get('r')
+        if kind == 'added' and light_sensor in RESOURCES:
+            # The event holds the new light/sensor/group. Fetch it if not
+            data = event.get(light_sensor[:-1])
+            if data:
+                self.resource_added(light_sensor, event['id'], data)
+            else:
+                self.io.spawn(self.refresh_resource(light_sensor, event['id']))
+        elif kind == 'deleted' and light_sensor in RESOURCES:
+            self.resource_deleted(light_sensor, event['id'])
+        elif kind == 'scene-called':
+            self.io.spawn(self.scene_called(event.get('gid')))
+        else:
+            return False
+        self.adapter.metrics.count('inventory.' + kind)
+        return True
+
+    def resource_found(self, light_sensor, dev_id, data):
+        """ Called by the poller for a light/sensor/group without device. Added if it is new """
+        key = (light_sensor, str(dev_id))
+        if key not in self.device_mapping and key not in self.unsupported:
+            self.adapter.metrics.count('inventory.found')
+            self.resource_added(light_sensor, dev_id, data)
+
+    def resource_added(self, light_sensor, dev_id, data):
+        """ Add the device for one new light/sensor/group. Runs in the io loop """
+        key = (light_sensor, str(dev_id))
+        try:
+            self.add_devices({light_sensor: {str(dev_id): data}})
+        except Exception as ex:
+            logger.exception('ERROR Exception %s', ex)
+        if key not in self.device_mapping:
+            self.unsupported.add(key)
+            return
+        self.add_route(key)
+        self.inventory.add(light_sensor, dev_id, data)
+
+    def resource_deleted(self, light_sensor, dev_id):
+        """ Remove the device of a light/sensor/group deleted in deCONZ. Runs in the io loop """
+        key = (light_sensor, str(dev_id))
+        self.unsupported.discard(key)
+        self.poller.forget(key)
+        self.inventory.remove(light_sensor, dev_id)
+        uid = self.device_mapping.pop(key, None)
+        self.routes.pop(key, None)
+        # Sensors with more than one endpoint share the device
+        if uid is None or uid in self.device_mapping.values():
+            return
+        device = self.adapter.get_device(uid)
+        if device is not None:
+            self.adapter.handle_device_removed(device)
+
+    def device_removed(self, device):
+        """ Drop the routes, poll state and stored state of a removed device. Runs in the io loop """
+        for key in [key for key, routed in self.routes.items() if routed is device]:
+            del self.routes[key]
+            self.poller.forget(key)
+        self.poller.policy.remove(device)
+        self.adapter.store.remove(device.id)
+
+    async def refresh_resource(self, light_sensor, dev_id):
+        """ Fetch one light/sensor/group and add or update its device. Returns the json """
+        try:
+            data = await self.scheduler.run(self.rest.get_resource, light_sensor, dev_id, priority=LOW,
+                                            key=(light_sensor, str(dev_id)))
+        except Exception as ex:
+            logger.error('Could not fetch %s %s: %s', light_sensor, dev_id, ex)
+            return None
+        if (light_sensor, str(dev_id)) in self.routes:
+            self.poller.dispatch(light_sensor, str(dev_id), data, time.time(), force=True)
+        else:
+            self.resource_added(light_sensor, dev_id, data)
+        return data
+
+    async def scene_called(self, group_id):
+        """ A scene changes the lights of the group. Fetch the group and its lights """
+        if group_id is None:
+            return
+        group = await self.refresh_resource('groups', group_id)
+        if group is None:
+            return
+        for light_id in group.get('lights', []):
+            await self.refresh_resource('lights', light_id)
+
+    def warm_start(self):
+        """
+        Create the devices from the inventory snapshot of the last run and
+        reconcile them with deCONZ in the background.
+        """
+        snapshot = self.inventory.load()
+        if snapshot is not None:
+            start = time.perf_counter()
+            self.add_devices(snapshot)
+            self.build_routes()
+            logger.info('%s devices from inventory snapshot in %.3f s',
+                        len(self.adapter.get_devices()), time.perf_counter() - start)
+            if snapshot.get('config'):
+                self.start_ws(snapshot['config'])
+        self.sync_task = self.io.spawn(self.reconcile())
+
+    async def reconcile(self):
+        """ Fetch the live state, retry until deCONZ answers, and sync the devices with it """
+        backoff = MIN_BACKOFF
+        while True:
+            try:
+                full_state = await self.scheduler.run(self.rest.get_full_state)
+                break
+            except ValueError as ex:
+                logger.exception('ERROR Exception %s', ex)
+                msg = 'Zigbee-Conbee Adapter: Problem during pairing of devices. Check URL.'
+                self.adapter.send_error(msg)
+                return
+            except Exception as ex:
+                logger.error('deCONZ not available %s. Retry in %s s', ex, backoff)
+                await self.io.timers.sleep(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+        self.sync_inventory(full_state)
+
+    def start_pairing(self):
+        """ Fetch the live state and add new devices in the io loop. Returns at once """
+        logger.info('START Pairing %s', self.name)
+        if self.sync_task is not None and not self.sync_task.done():
+            # Still syncing. New devices are added when it is done
+            return
+        self.sync_task = self.io.spawn(self.pair())
+
+    async def pair(self):
+        """ Fetch the live state through the scheduler and sync the devices with it """
+        try:
+            full_state = await self.scheduler.run(self.rest.get_full_state)
+        except ValueError as ex:
+            logger.exception('ERROR Exception %s', ex)
+            msg = 'Zigbee-Conbee Adapter: Problem during pairing of devices. Check URL.'
+            self.adapter.send_error(msg)
+            return
+        except Exception as ex:
+            logger.exception('ERROR Exception %s', ex)
+            return
+        self.sync_inventory(full_state)
+
+    def sync_inventory(self, full_state):
+        """
+        Add new devices from the live deCONZ state and update the known ones.
+        Devices no longer in deCONZ are shown as not reachable. Runs in the io loop.
+
+        full_state -- full state from deCONZ
+        """
+        try:
+            self.add_devices(full_state)
+            self.build_routes()
+            now = time.time()
+            live = set()
+            for light_sensor in RESOURCES:
+                for dev_id, data in full_state.get(light_sensor, {}).items():
+                    live.add((light_sensor, dev_id))
+                    try:
+                        self.poller.dispatch(light_sensor, dev_id, data, now, force=True)
+                    except Exception as ex:
+                        logger.exception('ERROR %s %s not updated: %s', light_sensor, dev_id, ex)
+            for key, device in self.routes.items():
+                if key not in live:
+                    logger.warning('Device %s %s not found in deCONZ', key, device.name)
+                    device.set_reachable(False)
+            self.inventory.update(full_state)
+            self.inventory.save()
+            self.start_ws(full_state.get('config', {}))
+        except Exception as ex:
+            logger.exception('ERROR Exception %s', ex)
+
+    def add_devices(self, inventory):
+        """
+        Create devices not already added. A light, sensor or group that
+        can not be added is logged and the others are still added.
+
+        inventory -- lights, sensors and groups as in the full deCONZ state or the snapshot
+        """
+        logger.info('START Pairing Lights')
+        for k, light in inventory.get('lights', {}).items():
+            try:
+                self.add_light(k, light)
+            except Exception as ex:
+                logger.exception('ERROR Light %s not added: %s', k, ex)
+        logger.info('START Pairing Sensors')
+        for k, sensor in inventory.get('sensors', {}).items():
+            try:
+                self.add_sensor(k, sensor)
+            except Exception as ex:
+                logger.exception('ERROR Sensor %s not added: %s', k, ex)
+        logger.info('START Pairing Groups')
+        for k, group in inventory.get('groups', {}).items():
+            try:
+                self.add_group(k, group)
+            except Exception as ex:
+                logger.exception('ERROR Group %s not added: %s', k, ex)
+        logger.debug('device_mapping: %s', self.device_mapping)
+
+    def add_light(self, k, light):
+        uid = self.get_uid(light)
+        # Check if already added
+        if self.adapter.get_device(uid) != None:
+            logger.debug('Light device %s already exist. Not added again', uid);
+            return
+        logger.debug('Ligths: %s %s', k, light)
+        logger.info('Add light %s', uid)
+        device = self.create_light_device(uid, str(k), light)
+        if device is None:
+            logger.warning('Unknow type of light: %s', k)
+        else:
+            self.add_device_mapping('lights', k, uid)
+            self.adapter.handle_device_added(device)
+
+    def add_sensor(self, k, sensor):
+        uid = self.get_uid(sensor)
+        if self.adapter.get_device(uid) != None:
+            logger.debug('Sensor device %s already exist. Will not crate a new device', uid);
+            self.add_device_mapping('sensors', k, uid)
+            return
+        logger.debug('Sensors: %s %s', k, sensor)
+        if sensor['type'].startswith('ZHAPresence'):
+            device = ConBeeZHAPresenceSensor(self, uid, str(k), sensor)
+            self.add_device_mapping('sensors', k, uid)
+            logger.debug('Sensor %s added', k)
+            self.adapter.handle_device_added(device)
+        elif sensor['type'].startswith('ZHASwitch'):
+            device = ConBeeDimmerButton(self, uid, str(k), sensor)
+            self.add_device_mapping('sensors', k, uid)
+            logger.debug('Sensor %s added', k)
+            self.adapter.handle_device_added(device)
+        elif sensor['type'].startswith('ZHATemperature'):
+            device = ConBeeZHATemperatureSensor(self, uid, str(k), sensor, self.adapter._config.temp_unit_celsius)
+            self.add_device_mapping('sensors', k, uid)
+            logger.debug('Sensor %s added', k)
+            self.adapter.handle_device_added(device)
+        else:
+            self.add_device_mapping('sensors', k, uid)
+            logger.debug('Unknow sensor. Not added')
+
+    def add_group(self, k, group):
+        uid = self.get_group_uid(k)
+        if self.adapter.get_device(uid) != None:
+            logger.debug('Group device %s already exist. Not added again', uid);
+            return
+        if len(group.get('lights', [])) == 0:
+            logger.debug('Empty group %s. Not added', k)
+            return
+        device = ConBeeLightGroup(self, uid, str(k), group)
+        self.add_device_mapping('groups', k, uid)
+        logger.debug('Group %s added', k)
+        self.adapter.handle_device_added(device)
+
+    def start_ws(self, config):
+        """
+        Connect the websocket. Reconnect if the address has changed.
+        config -- deCONZ config with ipaddress and websocketport
+        """
+        if 'ipaddress' not in config or 'websocketport' not in config:
+            return
+        ws_url = 'ws://{}:{}'.format(config['ipaddress'], config['websocketport'])
+        if self.ws is not None:
+            if self.ws.url == ws_url:
+                return
+            logger.info('Websocket url changed from %s', self.ws.url)
+            self.ws.close()
+        logger.info('Used websocket url: %s', ws_url)
+        self.ws = WsClient(self, ws_url, 5)
+
+    def ws_connected(self):
+        """ Called in the io loop when the websocket is connected """
+        if self.adapter._config.event_driven:
+            self.poller.suspend()
+        self.io.spawn(self.poller.resync())
+
+    def ws_disconnected(self):
+        """ Called in the io loop when the websocket is lost. Fall back to polling """
+        self.poller.websocket_lost()
+        self.poller.resume()
+
+    def stop(self):
+        """ Stop polling, the websocket and background sync. Called before the io loop is stopped """
+        self.poller.stop()
+        if self.sync_task is not None:
+            self.sync_task.cancel()
+        if self.ws is not None:
+            self.ws.close()
+
+    def close(self):
+        """ Save the inventory and close the connections. Called after the io loop is stopped """
+        self.inventory.refresh(self.adapter.store, self.device_mapping)
+        self.inventory.save()
+        logger.info('%s Writer: %s', self.name, self.writer.stats())
+        logger.info('%s Scheduler: %s', self.name, self.scheduler.stats())
+        logger.info('%s Connection pool: %s', self.name, self.rest.pool_stats())
+        logger.info('%s Poll intervals: %s', self.name, self.poller.policy.stats())
+        self.executor.shutdown(wait=False)
+        self.rest.close()
+        if self.recorder is not None:
+            self.recorder.close()
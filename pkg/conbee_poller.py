@@ -0,0 +1,173 @@
+"""Poll engine for ConBee adapter. One timer in the io loop polls all devices of a gateway."""
+
+import logging
+import time
+
+from command_scheduler import LOW, QueueFull
+from diagnostics import DIAGNOSTICS
+from poll_policy import AdaptivePollPolicy
+from timer_queue import jittered
+
+# Due times of devices vary by this part of their poll interval
+JITTER = 0.1
+
+logger = logging.getLogger('conbee.poller')
+
+
+class ConBeePoller:
+    """
+    Fetch the full deCONZ state when a device is due and hand each device
+    the part of it that has changed since the previous fetch. State and
+    config of a device are due at different times. The state interval
+    of each device is set by the AdaptivePollPolicy.
+    """
+
+    def __init__(self, gateway, interval=2, policy=None):
+        """
+        gateway -- the ConBeeGateway owning the devices
+        interval -- seconds between two checks for due devices
+        policy -- AdaptivePollPolicy deciding when each device is due
+        """
+        self.gateway = gateway
+        self.interval = interval
+        self.policy = policy or AdaptivePollPolicy(gateway.metrics, interval)
+        self.etags = {}     # Map between light/sensor key and last seen etag
+        self.config_etags = {}      # Same for the config section
+        self.state_pending = {}     # light/sensor key -> time its changed state is due
+        self.config_pending = {}    # light/sensor key -> time its changed config is due
+        self.polled = {}            # device -> (new etag, updated) since the last reschedule
+        self.validator = None   # Of the last full state. See DeconzRestApi.get_json_if_changed
+        self.suspended = False
+        self.task = None    # Running poll
+        logger.info('poller START interval: %s', self.interval)
+        self.timer = gateway.io.timers.call_every(interval, self.tick, name='poll', jitter=JITTER)
+
+    def tick(self):
+        """ Start a poll if a device is due, unless suspended or the previous poll is still running """
+        if self.suspended or (self.task is not None and not self.task.done()):
+            return
+        if not self.due(time.time()):
+            self.gateway.metrics.count('poll.not_due')
+            return
+        self.task = self.gateway.io.loop.create_task(self.run())
+
+    def due(self, now):
+        """ True if the state or config of a device is due. Always before devices are known """
+        devices = set(self.gateway.routes.values())
+        return not devices or any(min(device.next_poll, device.next_config_poll) <= now for device in devices)
+
+    async def run(self):
+        try:
+            await self.poll()
+        except QueueFull:
+            self.gateway.metrics.count('poll.skipped')
+        except Exception as ex:
+            self.gateway.metrics.count('poll.errors')
+            logger.exception('Exception %s', ex)
+            DIAGNOSTICS.dump_on_error('after poll error')
+
+    async def poll(self, force=False):
+        """ Fetch lights, sensors and groups in one request and dispatch the changes.
+            force -- update changed devices even if they are not due """
+        start = time.perf_counter()
+        validator = self.validator
+        if force or self.pending_due(time.time()):
+            # Changes seen in an earlier full state are due. Fetch it even if it is the same
+            validator = None
+        self.validator, json_dict = await self.gateway.scheduler.run(
+            self.gateway.rest.get_full_state_if_changed, validator, priority=LOW)
+        now = time.time()
+        if json_dict is None:
+            self.gateway.metrics.count('poll.unchanged')
+        else:
+            for light_sensor in ['lights', 'sensors', 'groups']:
+                for dev_id, data in json_dict.get(light_sensor, {}).items():
+                    self.dispatch(light_sensor, dev_id, data, now, force)
+        self.reschedule(now)
+        self.gateway.metrics.observe('poll.cycle', time.perf_counter() - start)
+
+    def pending_due(self, now):
+        return any(due <= now for pending in (self.state_pending, self.config_pending)
+                   for due in pending.values())
+
+    def reschedule(self, now):
+        """ Set when the polled devices and the devices still due are due next.
+            Devices still due had no change in the full state """
+        polled, self.polled = self.polled, {}
+        for device in set(self.gateway.routes.values()):
+            if device in polled or now >= device.next_poll:
+                new_etag, updated = polled.get(device, (False, False))
+                interval = self.policy.polled(device, now, new_etag, updated)
+                device.next_poll = now + jittered(interval, JITTER)
+            if now >= device.next_config_poll:
+                device.next_config_poll = now + jittered(self.policy.config_interval, JITTER)
+
+    def dispatch(self, light_sensor, dev_id, data, now, force=False):
+        """ Update the sections of the device that have changed and are due.
+            Changes not yet due are kept in state_pending and config_pending.
+            The due times are set by reschedule, after all keys of the device are dispatched """
+        device = self.gateway.get_device_from_mapping(light_sensor, dev_id)
+        if device is None:
+            self.gateway.resource_found(light_sensor, dev_id, data)
+            return
+        key = (light_sensor, dev_id)
+        etag = data.get('etag')
+        sections = []
+        seen = key in self.etags
+        state_new = etag is None or etag != self.etags.get(key)
+        state_due = force or now >= device.next_poll
+        if state_due:
+            self.state_pending.pop(key, None)
+            if state_new:
+                self.etags[key] = etag
+                sections += ['state', 'action']
+        elif state_new:
+            self.state_pending[key] = device.next_poll
+        config_new = etag is None or etag != self.config_etags.get(key)
+        if force or now >= device.next_config_poll:
+            self.config_pending.pop(key, None)
+            if config_new:
+                self.config_etags[key] = etag
+                sections.append('config')
+        elif config_new:
+            self.config_pending[key] = device.next_config_poll
+        changed = device.poll_update(data, sections) if sections else []
+        if state_due:
+            new_etag, updated = self.polled.get(device, (False, False))
+            # The first etag seen is not a change
+            self.polled[device] = (new_etag or (state_new and seen),
+                                   updated or any(section != 'config' for section, _ in changed))
+
+    def suspend(self):
+        """ Stop polling. Events from the websocket keep devices up to date """
+        logger.info('poller suspended')
+        self.suspended = True
+
+    def resume(self):
+        logger.info('poller resumed')
+        self.suspended = False
+
+    def websocket_lost(self):
+        """ Poll all devices at the next tick. Their intervals assumed the events """
+        self.policy.websocket_lost()
+        for device in set(self.gateway.routes.values()):
+            device.next_poll = 0
+
+    def forget(self, key):
+        """ The light/sensor key is deleted or its device removed """
+        self.etags.pop(key, None)
+        self.config_etags.pop(key, None)
+        self.state_pending.pop(key, None)
+        self.config_pending.pop(key, None)
+
+    async def resync(self):
+        """ One bulk fetch to catch up with changes missed while the websocket was down """
+        try:
+            await self.poll(force=True)
+        except Exception as ex:
+            logger.exception('Exception %s', ex)
+
+    def stop(self):
+        """ A running poll is cancelled with the other tasks when the io loop stops """
+        self.timer.cancel()
+        logger.info('poller STOP')
@@ -1,9 +1,14 @@
 """ConBee adapter for Mozilla IoT Gateway."""
 
 import logging
-import traceback
 from gateway_addon import Property
 
+from command_scheduler import HIGH
+from diagnostics import trace
+from util import hs_to_rgb, rgb_to_xy, xy_to_rgb
+
+logger = logging.getLogger('conbee.property')
+
 class ConBeeProperty(Property):
     """ConBee property type."""
 
@@ -33,27 +38,22 @@ class ConBeeProperty(Property):
         self.func_set = func_set
         if value is not None:
             self.set_value(value)
-        logging.info("ConbeeProperty__init__ device.id: %s %s %s %s", device.id, name, description, value)
+        logger.debug("ConbeeProperty__init__ device.id: %s %s %s %s", device.id, name, description, value)
 
     def set_cached_value(self, new_value):
-        logging.info('ccccccccccccc')
-        stack_str = ''.join(traceback.format_stack())
-        logging.info('set_cahced %s', stack_str)
         if 'minimum' in self.description:
             mini = int(self.description.get('minimum'))
             if new_value < mini:
-                logging.info('Below minimum. was %s set to %s', new_value, mini)
+                logger.debug('Below minimum. was %s set to %s', new_value, mini)
                 new_value = mini
 
         old_value = self.get_value()
         if old_value != new_value:
             super().set_cached_value(new_value)
             set_dev_val = self.prop2dev_value(new_value)
-            logging.info("prop: %s New property value: %s (%s) -> Dev.Value: %s (%s)",
-                         self.name, new_value, old_value, set_dev_val, self.dev_value)
+            trace('set_cached', self.device.id, self.name, new_value, old_value, set_dev_val)
             self.dev_value = set_dev_val
-            if self.func_set is not None:
-                self.func_set(self.device.dev_id, self.description['type'], self.name, set_dev_val)
+            self.send_device_value(set_dev_val)
         return new_value
 
     def dev2prop_value(self, value):
@@ -70,34 +70,52 @@ class ConBeeProperty(Property):
         """
         return value
 
+    def send_device_value(self, dvalue, priority=HIGH):
+        """ Send the new device value. func_set must not wait for the REST call
+            priority -- lane in the CommandScheduler """
+        if self.func_set is not None:
+            self.func_set(self.device.dev_id, self.description['type'], self.name, dvalue, priority=priority)
+
+    def apply_device_value(self, dvalue):
+        """ Value reported by the device, or sent to it by other means, e.g. a group.
+            Update the cached value and notify the gateway. Nothing is sent to the device """
+        if dvalue == self.dev_value:
+            return
+        self.dev_value = dvalue
+        super().set_cached_value(self.dev2prop_value(dvalue))
+        self.device.adapter.notifier.changed(self)
+
     def set_device_value(self, dvalue):
-        """ The device value to set """
-        if dvalue != self.dev_value:
-            new_value = self.dev2prop_value(dvalue)
-            self.set_value(new_value)
+        """ Value reported by the device in an event or a poll. Never sent back to the device """
+        self.apply_device_value(dvalue)
 
-    def set_value(self, new_pvalue):
+    def set_value(self, new_pvalue, priority=HIGH):
         """ Set the current value of the property. Overrides Property.set_value
-            value -- the value to set """
+            A running ramp, e.g. a fade, of the property is stopped
+            value -- the value to set
+            priority -- HIGH for user commands. LOW for background work as fades """
+        self.device.adapter.ramps.cancel(self)
+        self.send_value(new_pvalue, priority)
+
+    def send_value(self, new_pvalue, priority=HIGH):
+        """ Set the current value and send it to the device. Used by set_value and ramps """
         if new_pvalue != self.get_value():
             if 'minimum' in self.description:
                 mini = int(self.description.get('minimum'))
                 if new_pvalue < mini:
-                    logging.info('Below minimum. was %s set to %s', new_pvalue, mini)
+                    logger.debug('Below minimum. was %s set to %s', new_pvalue, mini)
                     new_pvalue = mini
 
             old_pvalue = self.get_value()
             if old_pvalue != new_pvalue:
                 super().set_cached_value(new_pvalue)
                 set_dval = self.prop2dev_value(new_pvalue)
-                logging.info("%s::%s = %s (%s) -> Dev.Value: %s (%s)",
-                             self.device.name, self.name, new_pvalue, old_pvalue, set_dval, self.dev_value)
+                trace('set', self.device.id, self.name, new_pvalue, old_pvalue, set_dval)
                 self.dev_value = set_dval
-                if self.func_set is not None:
-                    self.func_set(self.device.dev_id, self.description['type'], self.name, set_dval)
+                self.send_device_value(set_dval, priority)
             else:
-                logging.error('New value the sam as old_value')
-            self.device.notify_property_changed(self)
+                logger.error('New value the sam as old_value')
+            self.device.adapter.notifier.changed(self)
 
     def update(self):
         """
@@ -106,6 +124,8 @@ class ConBeeProperty(Property):
         if self.func_is is None:
             return
         new_dev_value = self.func_is(self.device, self)
+        if new_dev_value is None:
+            return
         self.set_device_value(new_dev_value)
 
 class ConBeeBooleanProperty(ConBeeProperty):
@@ -118,7 +138,7 @@ class ConBeeBooleanProperty(ConBeeProperty):
         desc = {'label': label, '@type': 'BooleanProperty', 'type': 'boolean', 'readOnly': read_only, 'description': 'True or False'}
         ConBeeProperty.__init__(self, device, name, desc,
                                 False)
-        logging.info('New Booelan property to %s', device.name)
+        logger.info('New Booelan property to %s', device.name)
         self.func_is = func_is
         self.func_set = func_set
 
@@ -133,7 +153,7 @@ class ConBeeOnOffProperty(ConBeeProperty):
         """
         ConBeeProperty.__init__(self, device, 'on', {'@type': 'OnOffProperty', 'type': 'boolean', 'description': 'On or Off'},
                                 False)
-        logging.info('OnOff property to %s', device.name)
+        logger.info('OnOff property to %s', device.name)
         self.func_is = func_is
         self.func_set = func_set
 
@@ -151,7 +171,7 @@ class ConBeeBrightnessProperty(ConBeeProperty):
         ConBeeProperty.__init__(self, device, name,
                                 {'label': label, '@type': 'BrightnessProperty', 'type': 'integer', 'min': min, 'max': 100,
                                  'unit': 'percent', 'multipleOf': 10, 'description': 'property descripton'}, 50)
-        logging.info('Brighness property to device %s', device.name)
+        logger.info('Brighness property to device %s', device.name)
         self.func_is = func_is
         self.func_set = func_set
 
@@ -186,7 +206,46 @@ class ConBeeColorTemperatureProperty(ConBeeProperty):
                 'max': ctmax, 'description': 'property descripton'}
         ConBeeProperty.__init__(self, device, 'ct', desc, func_is=func_is, func_set=func_set)
         self.update()
-        logging.info('Color temperature property to device %s', device.name)
+        logger.info('Color temperature property to device %s', device.name)
+
+
+class ConBeeColorProperty(ConBeeProperty):
+    """
+    Color property. The property value is an RGB hex string. The device value is
+    ('xy', x, y) or ('hs', hue, sat) as the light reports it. Always sent as xy
+    """
+
+    def __init__(self, device, func_is, func_set):
+        """
+        device - the deivce
+        func_is - function returning the device value from the state of the light
+        func_set - function that change the value func_set(dev_id, type, key, value)
+        """
+        desc = {'label': 'Color', '@type': 'ColorProperty', 'type': 'string', 'description': 'RGB color'}
+        ConBeeProperty.__init__(self, device, 'color', desc, func_is=func_is, func_set=func_set)
+        self.dev_value = None
+        self.update()
+        logger.info('Color property to device %s', device.name)
+
+    def dev2prop_value(self, value):
+        """ ('xy', x, y) or ('hs', hue, sat) -> #RRGGBB """
+        if value[0] == 'hs':
+            return hs_to_rgb(value[1], value[2])
+        return xy_to_rgb(value[1], value[2])
+
+    def prop2dev_value(self, value):
+        """ #RRGGBB -> ('xy', x, y) """
+        return ('xy',) + rgb_to_xy(value)
+
+    def send_device_value(self, dvalue, priority=HIGH):
+        if self.func_set is not None:
+            self.func_set(self.device.dev_id, 'array', 'xy', [dvalue[1], dvalue[2]], priority=priority)
+
+    def set_device_value(self, dvalue):
+        """ Events have xy or hue and sat. The value is taken from the state of the light """
+        dvalue = self.func_is(self.device, self)
+        if dvalue is not None:
+            super().set_device_value(dvalue)
 
 
 class ConBeeMotionProperty(ConBeeProperty):
@@ -194,28 +253,28 @@ class ConBeeMotionProperty(ConBeeProperty):
         desc = {'label': label, '@type': 'MotionProperty', 'type': 'boolean', 'readOnly': True, 'description': 'motion or not descripton'}
         ConBeeProperty.__init__(self, device, name, desc, func_is=func_is)
         self.update()
-        logging.info('Motion property to device %s', device.name)
+        logger.info('Motion property to device %s', device.name)
 
 class ConBeePushedProperty(ConBeeProperty):
     def __init__(self, device, func_is):
         desc = {'label': 'Pushed', '@type': 'PushedProperty', 'type': 'integer', 'readOnly': True, 'description': 'pushed descripton'}
         ConBeeProperty.__init__(self, device, 'buttonevent', desc, func_is=func_is)
         self.update()
-        logging.info('PushedProperty to device %s', device.name)
+        logger.info('PushedProperty to device %s', device.name)
 
 class ConBeeLevelProperty(ConBeeProperty):
     def __init__(self, device, label, name, func_is):
         desc = {'label': label, '@type': 'LevelProperty', 'type': 'integer', 'minimum': 0, 'maximum': 100,
                 'unit': 'percent','readOnly': True, 'description': 'Battery level'}
         ConBeeProperty.__init__(self, device, name, desc, func_is=func_is)
-        logging.info('Level property to device %s', device.name)
+        logger.info('Level property to device %s', device.name)
 
 class InstantaneousPowerProperty(ConBeeProperty):
     def __init__(self, device, label, name, func_is):
         desc = {'label': label, '@type': 'InstantaneousPowerProperty', 'type': 'integer',
                 'unit': 'watt','readOnly': True, 'description': 'Power effect'}
         ConBeeProperty.__init__(self, device, name, desc, func_is=func_is)
-        logging.info('InstantaneousPowerProperty to device %s', device.name)
+        logger.info('InstantaneousPowerProperty to device %s', device.name)
 
 class ReachableProperty(ConBeeProperty):
     def __init__(self, device, value):
@@ -224,7 +283,7 @@ class ReachableProperty(ConBeeProperty):
                                  'description': 'On or Off', 'readOnly': True, 'visible': True},
                                 None)
         self.set_device_value(value)
-        logging.info('Reachable property to %s', device.name)
+        logger.info('Reachable property to %s', device.name)
 
     def set_device_value(self, value):
         """ The device value to set """
@@ -246,7 +305,7 @@ class TemperatureProperty(ConBeeProperty):
                 'readOnly': True, 'description': 'Temperature'}
         ConBeeProperty.__init__(self, device, name, desc, func_is=func_is)
         self.update()
-        logging.info('Temperature property to device %s', device.name)
+        logger.info('Temperature property to device %s', device.name)
 
     def dev2prop_value(self, value):
         """
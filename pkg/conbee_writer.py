@@ -0,0 +1,130 @@
+"""
+ConBee adapter for Mozilla IoT Gateway.
+Coalesce outgoing state changes per device into one REST PUT
+"""
+import logging
+
+from command_scheduler import HIGH, LOW, QueueFull
+
+logger = logging.getLogger('conbee.writer')
+
+# Min seconds before values not queued because the lane was full are tried again
+MIN_RETRY = 0.01
+
+
+class WriteCoalescer:
+    """
+    Hold outgoing values per device for a short window. A later value for
+    the same key replaces the earlier one and different keys are merged into
+    one PUT. Only one PUT per device is in flight. Values written meanwhile
+    are sent when it is done, so stale values are never sent.
+    All state is only touched in the io loop.
+    """
+
+    def __init__(self, io, scheduler, window):
+        """
+        io -- the IoLoop running the REST calls
+        scheduler -- the CommandScheduler sending the PUTs
+        window -- seconds to wait for more values before sending
+        """
+        self.io = io
+        self.scheduler = scheduler
+        self.window = window
+        self.pending = {}       # target -> {key: value}
+        self.transitions = {}   # target -> {key: transitiontime} of the pending keys written with transition
+        self.senders = {}       # target -> func(values)
+        self.priority = {}      # target -> HIGH if any pending value is HIGH
+        self.scheduled = set()  # targets with a flush scheduled
+        self.in_flight = set()  # targets with a PUT running
+        self.counters = {'writes': 0, 'puts': 0, 'replaced': 0, 'requeued': 0}
+
+    def write(self, target, key, value, send, priority=HIGH, transition=None):
+        """
+        Queue value for sending. Safe to call from any thread.
+
+        target -- identifies the device, e.g. ('lights', '1')
+        key -- deconz key, e.g. 'bri'
+        value -- device value
+        send -- func(values) sending a dict of key/values to the device
+        priority -- lane in the CommandScheduler
+        transition -- deCONZ transitiontime in 1/10 s. A write of key without
+                      transition cancels a pending transition of key. The PUT
+                      has the longest transition of its keys
+        """
+        self.io.call_soon(self._write, target, key, value, send, priority, transition)
+
+    def _write(self, target, key, value, send, priority, transition):
+        self.counters['writes'] += 1
+        pending = self.pending.setdefault(target, {})
+        if key in pending:
+            self.counters['replaced'] += 1
+        pending[key] = value
+        transitions = self.transitions.setdefault(target, {})
+        if transition is None:
+            transitions.pop(key, None)
+        else:
+            transitions[key] = transition
+        self.senders[target] = send
+        self.priority[target] = min(self.priority.get(target, LOW), priority)
+        self.schedule(target)
+
+    def schedule(self, target, delay=None):
+        """ Flush target after delay seconds. The window if None """
+        if target in self.scheduled or target in self.in_flight:
+            return
+        self.scheduled.add(target)
+        delay = self.window if delay is None else delay
+        if delay > 0:
+            self.io.timers.call_later(delay, self.flush, target)
+        else:
+            self.io.loop.call_soon(self.flush, target)
+
+    def flush(self, target):
+        self.scheduled.discard(target)
+        values = self.pending.pop(target, None)
+        transitions = self.transitions.pop(target, {})
+        if not values:
+            return
+        body = dict(values)
+        if transitions:
+            body['transitiontime'] = max(transitions.values())
+        self.counters['puts'] += 1
+        self.in_flight.add(target)
+        priority = self.priority.pop(target, HIGH)
+        future = self.scheduler.run(self.senders[target], body, priority=priority, key=target)
+        future.add_done_callback(lambda f: self.done(target, values, transitions, priority, f))
+
+    def done(self, target, values, transitions, priority, future):
+        self.in_flight.discard(target)
+        delay = None
+        if not future.cancelled() and isinstance(future.exception(), QueueFull):
+            # Not sent. Keep the values unless replaced meanwhile. Try again when the
+            # lane may have room, at least one request later
+            self.counters['requeued'] += 1
+            delay = max(self.window, 1 / self.scheduler.rate, MIN_RETRY)
+            pending = self.pending.setdefault(target, {})
+            pending_transitions = self.transitions.setdefault(target, {})
+            for key, value in values.items():
+                if key not in pending:
+                    pending[key] = value
+                    if key in transitions:
+                        pending_transitions[key] = transitions[key]
+            self.priority[target] = min(self.priority.get(target, LOW), priority)
+        elif not future.cancelled() and future.exception() is not None:
+            logger.error('Write to %s failed %s', target, future.exception())
+        if target in self.pending:
+            self.schedule(target, delay)
+
+    def discard(self, target):
+        """ Drop values not yet sent, e.g. for a removed device. Safe to call from any thread """
+        self.io.call_soon(self._discard, target)
+
+    def _discard(self, target):
+        self.pending.pop(target, None)
+        self.transitions.pop(target, None)
+        self.priority.pop(target, None)
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats['pending'] = len(self.pending)
+        return stats
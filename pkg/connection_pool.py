@@ -0,0 +1,130 @@
+"""
+ConBee adapter for Mozilla IoT Gateway.
+Pool of keep-alive HTTP connections to deCONZ
+"""
+import http.client
+import logging
+import threading
+import time
+import urllib.parse
+
+logger = logging.getLogger('conbee.rest')
+
+
+class ConnectionPool:
+    """ Keep HTTP connections to one host open and reuse them between requests. """
+
+    def __init__(self, url, size=4, idle_timeout=30, timeout=10):
+        """
+        url -- url to the host. Only scheme, host and port are used
+        size -- max number of idle connections kept open
+        idle_timeout -- seconds an idle connection is kept before it is closed
+        timeout -- socket timeout in seconds
+        """
+        parts = urllib.parse.urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port
+        self.https = parts.scheme == 'https'
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.idle = []     # (connection, time when released)
+        self.counters = {'requests': 0, 'created': 0, 'reused': 0, 'reconnects': 0, 'closed': 0}
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def stats(self):
+        """ Copy of the counters with number of idle connections """
+        with self.lock:
+            stats = dict(self.counters)
+            stats['idle'] = len(self.idle)
+        return stats
+
+    def new_connection(self):
+        self.count('created')
+        if self.https:
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def acquire(self):
+        """ Return (connection, reused). Idle connections that timed out are closed """
+        now = time.monotonic()
+        expired = []
+        conn = None
+        with self.lock:
+            while self.idle:
+                conn, released = self.idle.pop()
+                if now - released < self.idle_timeout:
+                    break
+                expired.append(conn)
+                conn = None
+        for old in expired:
+            self.close(old)
+        if conn is None:
+            return self.new_connection(), False
+        self.count('reused')
+        return conn, True
+
+    def release(self, conn):
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append((conn, time.monotonic()))
+                return
+        self.close(conn)
+
+    def close(self, conn):
+        self.count('closed')
+        conn.close()
+
+    def close_all(self):
+        with self.lock:
+            idle = self.idle
+            self.idle = []
+        for conn, _ in idle:
+            self.close(conn)
+
+    def request(self, method, path, body=None, headers=None):
+        """
+        Send a request and read the whole response.
+        Returns (status, reason, headers, body)
+
+        method -- GET, PUT ...
+        path -- path on the host
+        body -- bytes to send
+        """
+        self.count('requests')
+        conn, reused = self.acquire()
+        try:
+            resp = self.send(conn, method, path, body, headers)
+        except (ConnectionError, http.client.HTTPException) as ex:
+            # Keep-alive connection closed by deCONZ. Try once on a new connection
+            self.close(conn)
+            if not reused:
+                raise
+            logger.debug('Reconnect %s %s after %s', method, path, ex)
+            self.count('reconnects')
+            conn = self.new_connection()
+            try:
+                resp = self.send(conn, method, path, body, headers)
+            except Exception:
+                self.close(conn)
+                raise
+        except Exception:
+            self.close(conn)
+            raise
+        status, reason, resp_headers, data, will_close = resp
+        if will_close:
+            self.close(conn)
+        else:
+            self.release(conn)
+        return status, reason, resp_headers, data
+
+    @staticmethod
+    def send(conn, method, path, body, headers):
+        conn.request(method, path, body=body, headers=headers or {})
+        resp = conn.getresponse()
+        data = resp.read()
+        return resp.status, resp.reason, resp.headers, data, resp.will_close
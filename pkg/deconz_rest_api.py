@@ -2,11 +2,17 @@
 ConBee adapter for Mozilla IoT Gateway.
 Rest API using DevConz API
 """
+import hashlib
 import json
 import logging
-import sys
-import traceback
-import urllib.request
+import time
+import urllib.error
+import urllib.parse
+
+from connection_pool import ConnectionPool
+from metrics import Metrics
+
+logger = logging.getLogger('conbee.rest')
 
 class State:
     def __init__(self):
@@ -23,31 +29,110 @@ class Light:
 
 # Type of keys values when sending to device
 BOOLEANS = ['on', 'presence']
-INTEGERS = ['bri', 'ct']
+INTEGERS = ['bri', 'ct', 'hue', 'sat', 'transitiontime']
+ARRAYS = ['xy']
 
 
 class DeconzRestApi:
-    def __init__(self, conbee_url):
+    def __init__(self, conbee_url, pool_size=4, idle_timeout=30, metrics=None):
+        """
+        conbee_url -- url to the REST API including api key
+        pool_size -- max number of idle keep-alive connections
+        idle_timeout -- seconds before an idle connection is closed
+        metrics -- Metrics for latency per endpoint
+        """
         self.conbee_url = conbee_url
+        self.metrics = metrics or Metrics()
+        self.base_path = urllib.parse.urlsplit(conbee_url).path.rstrip('/')
+        self.pool = ConnectionPool(conbee_url, pool_size, idle_timeout)
+
+    def request(self, method, resource, data=None):
+        """ Send request on a pooled connection. Returns the response body
+            method -- GET, PUT ...
+            resource -- path below the api key, e.g. 'lights/1'
+            data -- bytes to send
+        """
+        status, headers, body = self.send_request(method, resource, data)
+        return body
+
+    def send_request(self, method, resource, data=None, headers=None):
+        """ Same as request. Returns (status, headers, body)
+            headers -- dict with request headers """
+        path = self.base_path + '/' + resource
+        name = 'rest.{} {}'.format(method, resource.split('/', 1)[0] or 'full')
+        start = time.perf_counter()
+        try:
+            status, reason, resp_headers, body = self.pool.request(method, path, data, headers)
+        except Exception:
+            self.metrics.count('rest.errors')
+            raise
+        self.metrics.observe(name, time.perf_counter() - start)
+        if status >= 400:
+            self.metrics.count('rest.errors')
+            raise urllib.error.HTTPError(self.conbee_url + resource, status, reason, resp_headers, None)
+        return status, resp_headers, body
+
+    def get_json(self, resource):
+        json_response = self.request('GET', resource)
+        return json.loads(json_response.decode("utf-8"))
+
+    def get_json_if_changed(self, resource, validator=None):
+        """
+        Conditional GET. Returns (validator, json). json is None if the resource
+        has not changed since the validator of an earlier call.
+
+        The validator is the ETag of the response, sent back as If-None-Match so
+        an unchanged resource costs a 304 without a body. If deCONZ sends no ETag
+        it is a hash of the body, so an unchanged body is not decoded.
+        validator -- from the last call. None to always get the json
+        """
+        headers = None
+        if validator is not None and validator[0] == 'etag':
+            headers = {'If-None-Match': validator[1]}
+        status, resp_headers, body = self.send_request('GET', resource, headers=headers)
+        if status == 304:
+            self.metrics.count('rest.not_modified')
+            return validator, None
+        etag = resp_headers.get('ETag')
+        if etag:
+            new_validator = ('etag', etag)
+        else:
+            new_validator = ('hash', hashlib.blake2b(body, digest_size=16).digest())
+        if new_validator == validator:
+            self.metrics.count('rest.unchanged')
+            return validator, None
+        return new_validator, json.loads(body.decode('utf-8'))
+
+    def get_full_state_if_changed(self, validator=None):
+        """ get_full_state as a conditional GET. See get_json_if_changed """
+        return self.get_json_if_changed('', validator)
+
+    def get_full_state(self):
+        """ Full state of the gateway. Lights, sensors, groups and config in one request """
+        return self.get_json('')
 
     def get_config(self):
-        json_response = urllib.request.urlopen(self.conbee_url + '/config').read()
-        return json.loads(json_response.decode("utf-8"))
+        return self.get_json('config')
 
     def get_lights(self):
-        json_response = urllib.request.urlopen(self.conbee_url + '/lights').read()
-        return json.loads(json_response.decode("utf-8"))
+        return self.get_json('lights')
 
     def get_sensors(self):
-        json_response = urllib.request.urlopen(self.conbee_url + '/sensors').read()
-        return json.loads(json_response.decode("utf-8"))
+        return self.get_json('sensors')
 
-    def getLight(self, dev_id):
-        json_response = urllib.request.urlopen(self.conbee_url + '/lights/' + str(dev_id)).read()
-        return json.loads(json_response.decode("utf-8"))
-    def get_sensor(self, dev_id):
-        json_response = urllib.request.urlopen(self.conbee_url + '/sensors/' + str(dev_id)).read()
-        return json.loads(json_response.decode("utf-8"))
+    def get_groups(self):
+        return self.get_json('groups')
+
+    def get_resource(self, light_sensor, dev_id):
+        """ One light, sensor or group. light_sensor -- 'lights', 'sensors' or 'groups' """
+        return self.get_json('{}/{}'.format(light_sensor, dev_id))
+
+    def pool_stats(self):
+        """ Counters of the connection pool. Use to check that connections are reused """
+        return self.pool.stats()
+
+    def close(self):
+        self.pool.close_all()
 
     def setState(self, dev_id, state):
         """ dev_id -- device id
@@ -72,40 +157,57 @@ class DeconzRestApi:
             dev_id -- device id
             dic -- dict with keys and values
         """
-        json_data = '{'
-        first = True
-        for key, value in dic.items():
-            if first:
-                first = False
-            else:
-                json_data += ','
-            if key in BOOLEANS:
-                json_data += ' "{0}": {1} '.format(key, booleanToLower(value))
-            elif key in INTEGERS:
-                json_data += ' "{0}": {1} '.format(key, value)
-            else:
-                json_data += ' "{0}": "{1}" '.format(key, value)
-        json_data += '}'
-        self.send_state(dev_id, json_data)
+        self.send_state(dev_id, values_to_json(dic))
         return
 
+    def set_group_action(self, group_id, dic):
+        """ Set state on all lights in the group with one http PUT. Sent as one Zigbee groupcast
+            group_id -- group id
+            dic -- dict with keys and values
+        """
+        return self.send_json('groups/' + str(group_id) + '/action', values_to_json(dic))
+
     def send_state(self, dev_id, json_state):
         """ dev_id -- device id
             json_state -- new State to send to device
         """
+        self.send_json('lights/' + str(dev_id) + '/state', json_state)
+        return
+
+    def send_json(self, resource, json_state):
+        """ resource -- e.g. 'lights/1/state'
+            json_state -- new State to send
+            Return True if sent
+        """
         try:
             json_state = strToBytes(json_state)
-            logging.debug('set_state dev_id: %s -> %s', dev_id, json_state)
-            req = urllib.request.Request(url=self.conbee_url + 'lights/' + str(dev_id) + '/state', data=json_state, method='PUT')
-            with urllib.request.urlopen(req) as f:
-                logging.debug('Resp. dev_id: %s f.status: %s READ: %s', dev_id, f.status, f.read())
-                pass
+            logger.debug('send %s -> %s', resource, json_state)
+            resp = self.request('PUT', resource, json_state)
+            logger.debug('Resp. %s READ: %s', resource, resp)
+            return True
         except Exception as ex:
-            logging.exception('Exception %2', ex)
-            logging.error('Exception', ex.args)
-            logging.error(traceback.format_exception(None, # <- type(e) by docs, but ignored
-                                         ex, ex.__traceback__), file=sys.stderr)
-        return
+            logger.exception('Exception %s', ex)
+        return False
+
+def values_to_json(dic):
+    """ JSON for a dict with keys and values to send to device """
+    json_data = '{'
+    first = True
+    for key, value in dic.items():
+        if first:
+            first = False
+        else:
+            json_data += ','
+        if key in BOOLEANS:
+            json_data += ' "{0}": {1} '.format(key, booleanToLower(value))
+        elif key in INTEGERS:
+            json_data += ' "{0}": {1} '.format(key, value)
+        elif key in ARRAYS:
+            json_data += ' "{0}": {1} '.format(key, json.dumps(list(value)))
+        else:
+            json_data += ' "{0}": "{1}" '.format(key, value)
+    json_data += '}'
+    return json_data
 
 def booleanToLower(state):
     if state: return 'true'
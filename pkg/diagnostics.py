@@ -0,0 +1,64 @@
+"""
+ConBee adapter for Mozilla IoT Gateway.
+Diagnostics for the hot paths. Events are kept as records in a fixed size
+ring buffer instead of being formatted and logged. The buffer is written
+to the log on demand (SIGUSR1) or when an error occurs.
+"""
+import collections
+import logging
+import time
+
+logger = logging.getLogger('conbee.diagnostics')
+
+
+class Diagnostics:
+    """ Ring buffer of (time, kind, args) records """
+
+    def __init__(self, size=2000):
+        self.records = collections.deque(maxlen=size)
+        self.last_dump = 0
+
+    def trace(self, kind, *args):
+        """ Record an event. Nothing is formatted until the buffer is dumped """
+        self.records.append((time.time(), kind, args))
+
+    def resize(self, size):
+        self.records = collections.deque(self.records, maxlen=size)
+
+    def dump(self, reason='on demand'):
+        """ Write all records to the log """
+        records = list(self.records)
+        logger.warning('diagnostics dump %s. %s records', reason, len(records))
+        for when, kind, args in records:
+            logger.warning('%s.%03d %s %s', time.strftime('%H:%M:%S', time.localtime(when)),
+                           int(when * 1000) % 1000, kind, args)
+
+    def dump_on_error(self, reason, min_interval=60):
+        """ Dump, but at most once per min_interval seconds """
+        now = time.monotonic()
+        if now - self.last_dump >= min_interval:
+            self.last_dump = now
+            self.dump(reason)
+
+
+DIAGNOSTICS = Diagnostics()
+trace = DIAGNOSTICS.trace
+
+
+def set_log_levels(levels):
+    """
+    Set level per module.
+
+    levels -- e.g. 'ws:DEBUG, property:WARNING'. Names are the loggers
+              below 'conbee': adapter, device, property, ws, poller, rest, ...
+              A level without name is used for all modules, e.g. 'WARNING, ws:DEBUG'
+    """
+    for item in levels.split(','):
+        if not item.strip():
+            continue
+        name, level = item.split(':', 1) if ':' in item else ('', item)
+        name = name.strip()
+        try:
+            logging.getLogger('conbee.' + name if name else 'conbee').setLevel(level.strip().upper())
+        except ValueError:
+            logger.error('Unknown log level %s', item)
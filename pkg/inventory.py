@@ -0,0 +1,106 @@
+"""
+ConBee adapter for Mozilla IoT Gateway.
+Snapshot of the last known inventory and state on disk. Devices are
+created from it at start, before deCONZ has answered, and reconciled
+with the live state in the background.
+"""
+import json
+import logging
+import os
+
+from state_store import FIELDS
+
+logger = logging.getLogger('conbee.inventory')
+
+VERSION = 1
+RESOURCES = ('lights', 'sensors', 'groups')
+# Keys of a light/sensor/group used to create the device
+DEVICE_KEYS = ('name', 'manufacturername', 'type', 'uniqueid', 'ctmin', 'ctmax', 'lights', 'etag')
+# Keys of the deCONZ config used to connect the websocket
+CONFIG_KEYS = ('ipaddress', 'websocketport')
+
+
+def compact(full_state):
+    """ Only the parts of the full deCONZ state used to create devices """
+    snapshot = {'version': VERSION}
+    for resource in RESOURCES:
+        snapshot[resource] = {dev_id: compact_device(data)
+                              for dev_id, data in full_state.get(resource, {}).items()}
+    config = full_state.get('config', {})
+    snapshot['config'] = {key: config[key] for key in CONFIG_KEYS if key in config}
+    return snapshot
+
+
+def compact_device(data):
+    device = {key: data[key] for key in DEVICE_KEYS if key in data}
+    for section, key in FIELDS:
+        values = data.get(section)
+        if values and key in values:
+            device.setdefault(section, {})[key] = values[key]
+    return device
+
+
+class Inventory:
+    """ Snapshot in one json file. Written to a temp file and renamed """
+
+    def __init__(self, path):
+        """
+        path -- file name of the snapshot
+        """
+        self.path = path
+        self.snapshot = None
+
+    def load(self):
+        """ Return the snapshot. None if missing or unreadable """
+        try:
+            with open(self.path) as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            logger.info('No inventory snapshot %s', self.path)
+            return None
+        except (OSError, ValueError) as ex:
+            logger.warning('Unreadable inventory snapshot %s: %s', self.path, ex)
+            return None
+        if snapshot.get('version') != VERSION:
+            logger.info('Inventory snapshot version %s ignored', snapshot.get('version'))
+            return None
+        self.snapshot = snapshot
+        return snapshot
+
+    def update(self, full_state):
+        """ Replace the snapshot with the live state from deCONZ """
+        self.snapshot = compact(full_state)
+
+    def add(self, light_sensor, dev_id, data):
+        if self.snapshot is not None:
+            self.snapshot[light_sensor][str(dev_id)] = compact_device(data)
+
+    def remove(self, light_sensor, dev_id):
+        if self.snapshot is not None:
+            self.snapshot[light_sensor].pop(str(dev_id), None)
+
+    def refresh(self, store, device_mapping):
+        """ Copy the last known state of all devices from the StateStore into the snapshot """
+        if self.snapshot is None:
+            return
+        for resource in RESOURCES:
+            for dev_id, device in self.snapshot[resource].items():
+                uid = device_mapping.get((resource, dev_id))
+                if uid is None or uid not in store.records:
+                    continue
+                record = store.records[uid]
+                device.update(record.as_dict())
+                if record.etag is not None:
+                    device['etag'] = record.etag
+
+    def save(self):
+        if self.snapshot is None:
+            return
+        tmp = self.path + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp, 'w') as f:
+                json.dump(self.snapshot, f, separators=(',', ':'))
+            os.replace(tmp, self.path)
+        except OSError as ex:
+            logger.warning('Could not save inventory snapshot %s: %s', self.path, ex)
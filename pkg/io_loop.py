@@ -0,0 +1,81 @@
+"""
+ConBee adapter for Mozilla IoT Gateway.
+Asyncio event loop running in one dedicated thread. Owns the WebSocket,
+the poller and all REST calls to deCONZ.
+"""
+import asyncio
+import concurrent.futures
+import logging
+import threading
+
+from timer_queue import TimerQueue
+
+logger = logging.getLogger('conbee.io')
+
+
+class IoLoop:
+    """ One asyncio event loop in a dedicated thread """
+
+    def __init__(self, metrics=None):
+        """
+        metrics -- Metrics for the timers
+        """
+        self.loop = asyncio.new_event_loop()
+        self.timers = TimerQueue(self, metrics)
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='conbee-io')
+        self.thread.daemon = True
+        self.thread.start()
+        self.ready.wait()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_soon(self.ready.set)
+        logger.info('io loop START')
+        self.loop.run_forever()
+        logger.info('io loop STOP')
+
+    def in_loop(self):
+        """ True if called from the io loop thread """
+        return threading.current_thread() is self.thread
+
+    def call_soon(self, func, *args):
+        """ Run func(*args) in the io loop. Safe to call from any thread """
+        self.loop.call_soon_threadsafe(func, *args)
+
+    def spawn(self, coro):
+        """ Run a coroutine in the io loop. Safe to call from any thread.
+            Returns a concurrent.futures.Future """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run_blocking(self, func, *args, executor=None):
+        """ Awaitable running the blocking func(*args) in executor.
+            Only to be used from coroutines in the io loop
+            executor -- executor from new_executor. The asyncio default executor if None """
+        return self.loop.run_in_executor(executor, func, *args)
+
+    @staticmethod
+    def new_executor(workers, name):
+        """ Separate threads for blocking calls, e.g. one executor per deCONZ gateway.
+            The caller shuts it down """
+        return concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+
+    async def _cancel_tasks(self):
+        current = asyncio.current_task()
+        tasks = [task for task in asyncio.all_tasks() if task is not current]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stop(self, timeout=1):
+        """ Cancel all tasks and stop the loop.
+            Returns when the io thread has ended, or after timeout seconds.
+            REST calls already running are not waited for. The owners of
+            the executors shut them down """
+        if self.loop.is_running() and not self.in_loop():
+            try:
+                self.spawn(self._cancel_tasks()).result(timeout)
+            except Exception as ex:
+                logger.warning('Tasks not cancelled %s', ex)
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(timeout)
@@ -0,0 +1,120 @@
+"""
+ConBee adapter for Mozilla IoT Gateway.
+Counters and latency histograms for the hot paths. Cheap enough to be
+always on. Read with Metrics.snapshot, the periodic summary in the log,
+or the metrics.json file the adapter writes on SIGUSR2.
+"""
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger('conbee.metrics')
+
+# Upper bounds of the histogram buckets in seconds. 10 us .. ~100 s, 1.5x apart
+BUCKETS = []
+_bound = 0.00001
+while _bound < 100:
+    BUCKETS.append(_bound)
+    _bound *= 1.5
+
+
+class Histogram:
+    """ Durations in seconds in fixed buckets """
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, pct):
+        """ Upper bound of the bucket holding the percentile. pct -- 0..1 """
+        if self.count == 0:
+            return 0.0
+        wanted = pct * self.count
+        seen = 0
+        for ix, count in enumerate(self.counts):
+            seen += count
+            if seen >= wanted:
+                return min(BUCKETS[ix], self.max) if ix < len(BUCKETS) else self.max
+        return self.max
+
+    def as_dict(self):
+        """ Values in ms """
+        return {'count': self.count,
+                'avg': round(1000 * self.total / self.count, 2) if self.count else 0,
+                'p50': round(1000 * self.percentile(0.5), 2),
+                'p90': round(1000 * self.percentile(0.9), 2),
+                'p99': round(1000 * self.percentile(0.99), 2),
+                'max': round(1000 * self.max, 2)}
+
+
+class Metrics:
+    """ Named counters and histograms. Safe to use from any thread """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        """ Add a duration in seconds to the histogram name """
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = Histogram()
+                self.histograms[name] = histogram
+            histogram.observe(seconds)
+
+    def histogram(self, name):
+        """ Histogram name as dict in ms. None if nothing observed """
+        with self.lock:
+            histogram = self.histograms.get(name)
+            return histogram.as_dict() if histogram is not None else None
+
+    def snapshot(self):
+        """ All counters and histograms. Histograms in ms """
+        with self.lock:
+            return {'counters': dict(self.counters),
+                    'histograms': {name: h.as_dict() for name, h in self.histograms.items()}}
+
+    def summary(self):
+        """ Compact one line summary for the log """
+        snapshot = self.snapshot()
+        parts = ['{}={}'.format(name, value) for name, value in sorted(snapshot['counters'].items())]
+        for name, h in sorted(snapshot['histograms'].items()):
+            parts.append('{} n={} p50={} p99={} max={}ms'.format(name, h['count'], h['p50'], h['p99'], h['max']))
+        return ' | '.join(parts)
+
+    def write(self, path):
+        """ Write the snapshot as json to path. Written to a temp file and renamed """
+        snapshot = self.snapshot()
+        snapshot['time'] = time.time()
+        tmp = path + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp, 'w') as f:
+                json.dump(snapshot, f, indent=1, sort_keys=True)
+            os.replace(tmp, path)
+            logger.info('metrics written to %s', path)
+        except OSError as ex:
+            logger.warning('Could not write metrics %s: %s', path, ex)
+
+    def log_summary(self):
+        """ Log the summary. Run every metrics_interval seconds by the adapter """
+        logger.info('metrics %s', self.summary())
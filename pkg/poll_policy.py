@@ -0,0 +1,105 @@
+"""
+ConBee adapter for Mozilla IoT Gateway.
+Poll interval per device adapted to how often the device changes and how
+many of its changes the websocket already delivered. A device that seldom
+changes, or whose changes all arrive as events, is polled less often.
+"""
+import logging
+import statistics
+
+logger = logging.getLogger('conbee.poll')
+
+# Weight of the newest sample in the averages
+ALPHA = 0.2
+# Part of the time between changes used as interval when the websocket delivers none of them
+SAMPLE = 0.5
+# Interval stretch when the websocket delivers all changes. 1 + STRETCH * coverage
+STRETCH = 9
+# Change of the interval counted as stretched or shrunk
+REPORT_STEP = 1.1
+
+
+class PollState:
+    __slots__ = ('interval', 'gap', 'last_change', 'coverage')
+
+    def __init__(self, interval, now):
+        self.interval = interval        # Current poll interval in seconds
+        self.gap = interval / SAMPLE    # Average seconds between changes. Gives interval until changes are seen
+        self.last_change = now
+        self.coverage = 0.0             # Average part of changes delivered by the websocket
+
+
+class AdaptivePollPolicy:
+    """ Only to be used in the io loop """
+
+    def __init__(self, metrics, min_interval=2, max_interval=600, config_interval=3600):
+        """
+        metrics -- Metrics for the decisions
+        min_interval, max_interval -- bounds of the state poll interval in seconds
+        config_interval -- seconds between polls of the config section, e.g. battery
+        """
+        self.metrics = metrics
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.config_interval = config_interval
+        self.states = {}    # device id -> PollState
+
+    def state(self, device, now):
+        state = self.states.get(device.id)
+        if state is None:
+            # Start at the interval of the device class
+            interval = min(self.max_interval, max(self.min_interval, device.poll_interval))
+            state = self.states[device.id] = PollState(interval, now)
+        return state
+
+    def changed(self, state, now):
+        gap = now - state.last_change
+        state.gap += ALPHA * (gap - state.gap)
+        state.last_change = now
+
+    def event(self, device, now):
+        """ The websocket delivered a change of device """
+        self.changed(self.state(device, now), now)
+
+    def polled(self, device, now, new_etag, updated):
+        """
+        The state of device was polled. Returns the next interval.
+
+        new_etag -- the etag had changed since the last poll
+        updated -- the poll changed values not yet known from events
+        """
+        state = self.state(device, now)
+        if new_etag:
+            covered = 0.0 if updated else 1.0
+            state.coverage += ALPHA * (covered - state.coverage)
+            self.metrics.count('poll.missed' if updated else 'poll.covered')
+            if updated:
+                self.changed(state, now)
+        else:
+            self.metrics.count('poll.idle')
+        # Time since the last change is a lower bound of the gap of a quiet device
+        gap = max(state.gap, now - state.last_change)
+        interval = gap * SAMPLE * (1 + STRETCH * state.coverage)
+        interval = min(self.max_interval, max(self.min_interval, interval))
+        if interval > state.interval * REPORT_STEP:
+            self.metrics.count('poll.stretched')
+        elif interval * REPORT_STEP < state.interval:
+            self.metrics.count('poll.shrunk')
+        state.interval = interval
+        return interval
+
+    def websocket_lost(self):
+        """ Changes no longer come as events. Intervals shrink at the next poll of each device """
+        for state in self.states.values():
+            state.coverage = 0.0
+
+    def remove(self, device):
+        self.states.pop(device.id, None)
+
+    def stats(self):
+        """ Current intervals in seconds """
+        intervals = [state.interval for state in self.states.values()]
+        if not intervals:
+            return {'devices': 0}
+        return {'devices': len(intervals), 'min': round(min(intervals), 1),
+                'median': round(statistics.median(intervals), 1), 'max': round(max(intervals), 1)}
@@ -0,0 +1,118 @@
+"""
+ConBee adapter for Mozilla IoT Gateway.
+Ramps of property values over time, e.g. fades. All ramps are driven by
+one timer in the io loop instead of one thread per ramp.
+"""
+import logging
+import time
+
+from command_scheduler import LOW
+
+logger = logging.getLogger('conbee.ramp')
+
+# Seconds between two steps of stepped ramps
+STEP_INTERVAL = 0.5
+
+
+class Ramp:
+    __slots__ = ('prop', 'start_value', 'target', 'started', 'duration', 'stepped', 'done')
+
+    def __init__(self, prop, start_value, target, duration, stepped, done):
+        self.prop = prop
+        self.start_value = start_value
+        self.target = target
+        self.started = time.monotonic()
+        self.duration = duration
+        self.stepped = stepped
+        self.done = done
+
+    def value_at(self, now):
+        """ Property value at time now. Linear from start_value to target """
+        part = min(1.0, (now - self.started) / self.duration) if self.duration > 0 else 1.0
+        return int(round(self.start_value + (self.target - self.start_value) * part))
+
+
+class RampEngine:
+    """
+    Active ramps, at most one per property. A new ramp or a new command
+    to the property replaces the running ramp.
+
+    A stepped ramp sends a new value every STEP_INTERVAL. A hardware ramp
+    is one command with deCONZ transitiontime sent when it starts. It is
+    only kept here so that it can be cancelled and its done is called
+    when the transition has ended.
+    """
+
+    def __init__(self, io, metrics):
+        """
+        io -- the IoLoop driving the ramps
+        metrics -- Metrics for started and cancelled ramps
+        """
+        self.io = io
+        self.metrics = metrics
+        self.ramps = {}     # property -> Ramp
+        self.timer = None
+
+    def start(self, prop, target, duration, stepped=True, done=None):
+        """
+        Ramp prop from its current value to target. Safe to call from any thread.
+
+        prop -- ConBeeProperty
+        target -- property value at the end
+        duration -- seconds
+        stepped -- True to send steps. False if the device runs the ramp itself
+        done -- func() called when the ramp has ended or is cancelled
+        """
+        self.io.call_soon(self._start, prop, target, duration, stepped, done)
+
+    def cancel(self, prop):
+        """ Stop the ramp of prop, if any. Safe to call from any thread """
+        if prop in self.ramps:
+            self.io.call_soon(self._cancel, prop)
+
+    def _start(self, prop, target, duration, stepped, done):
+        self._cancel(prop)
+        start_value = prop.get_value() or 0
+        self.ramps[prop] = Ramp(prop, start_value, target, duration, stepped, done)
+        self.metrics.count('ramps.started')
+        self.schedule()
+
+    def _cancel(self, prop):
+        ramp = self.ramps.pop(prop, None)
+        if ramp is not None:
+            self.metrics.count('ramps.cancelled')
+            self.finish(ramp)
+
+    def schedule(self):
+        if self.timer is None and self.ramps:
+            self.timer = self.io.timers.call_later(STEP_INTERVAL, self.tick)
+
+    def tick(self):
+        """ Advance all ramps one step """
+        self.timer = None
+        now = time.monotonic()
+        for prop, ramp in list(self.ramps.items()):
+            if prop.device.stopped.is_set():
+                del self.ramps[prop]
+                continue
+            try:
+                if ramp.stepped:
+                    prop.send_value(ramp.value_at(now), priority=LOW)
+            except Exception as ex:
+                logger.exception('Ramp of %s failed %s', prop.name, ex)
+                ramp.started = 0
+            if now - ramp.started >= ramp.duration:
+                del self.ramps[prop]
+                self.finish(ramp)
+        self.schedule()
+
+    @staticmethod
+    def finish(ramp):
+        if ramp.done is not None:
+            try:
+                ramp.done()
+            except Exception as ex:
+                logger.exception('ERROR Exception %s', ex)
+
+    def stats(self):
+        return {'active': len(self.ramps)}
@@ -0,0 +1,113 @@
+"""
+ConBee adapter for Mozilla IoT Gateway.
+Store with the last known state of all devices. Only the fields used by
+the adapter are kept. Written by the poller and the websocket.
+"""
+from array import array
+
+# Fields of the deCONZ json used by the adapter. (section, key)
+FIELDS = [
+    ('state', 'on'),
+    ('state', 'bri'),
+    ('state', 'ct'),
+    ('state', 'xy'),
+    ('state', 'hue'),
+    ('state', 'sat'),
+    ('state', 'colormode'),
+    ('state', 'reachable'),
+    ('state', 'presence'),
+    ('state', 'dark'),
+    ('state', 'power'),
+    ('state', 'temperature'),
+    ('state', 'buttonevent'),
+    ('state', 'any_on'),
+    ('config', 'battery'),
+    ('config', 'reachable'),
+    ('action', 'on'),
+    ('action', 'bri'),
+    ('action', 'ct'),
+]
+SECTIONS = ('state', 'config', 'action')
+FIELD_INDEX = {field: ix for ix, field in enumerate(FIELDS)}
+
+
+class Record:
+    """ State of one device. Values and versions are indexed as FIELDS """
+    __slots__ = ('etag', 'values', 'versions')
+
+    def __init__(self):
+        self.etag = None
+        self.values = [None] * len(FIELDS)
+        self.versions = array('L', bytes(array('L').itemsize * len(FIELDS)))
+
+    def get(self, section, key, default=None):
+        ix = FIELD_INDEX.get((section, key))
+        if ix is None or self.values[ix] is None:
+            return default
+        return self.values[ix]
+
+    def version(self, section, key):
+        """ Store version when the field was last changed. 0 if never set """
+        return self.versions[FIELD_INDEX[(section, key)]]
+
+    def as_dict(self):
+        """ Known values as deCONZ json, e.g. {'state': {'on': True}} """
+        data = {}
+        for (section, key), value in zip(FIELDS, self.values):
+            if value is not None:
+                data.setdefault(section, {})[key] = value
+        return data
+
+
+class StateStore:
+    """ Records for all devices, keyed by device id """
+
+    def __init__(self):
+        self.records = {}
+        self.version = 0    # Incremented for every changed field
+
+    def record(self, uid):
+        """ Record of the device. Created if missing """
+        record = self.records.get(uid)
+        if record is None:
+            record = Record()
+            self.records[uid] = record
+        return record
+
+    def remove(self, uid):
+        self.records.pop(uid, None)
+
+    def update(self, uid, data, sections=None):
+        """
+        Write json for a light/sensor/group from a REST request.
+        Returns list of changed (section, key)
+
+        uid -- device id
+        data -- json from deCONZ
+        sections -- sections to write. All SECTIONS if None
+        """
+        record = self.record(uid)
+        changed = []
+        for section in sections or SECTIONS:
+            values = data.get(section)
+            if values:
+                changed += self.update_section(record, section, values)
+        if 'etag' in data:
+            record.etag = data['etag']
+        return changed
+
+    def update_section(self, record, section, values):
+        """
+        Write the keys of one section, e.g. 'state' from an event.
+        Returns list of changed (section, key)
+        """
+        changed = []
+        for key, value in values.items():
+            ix = FIELD_INDEX.get((section, key))
+            if ix is None or record.values[ix] == value:
+                continue
+            self.version += 1
+            record.values[ix] = value
+            record.versions[ix] = self.version
+            changed.append((section, key))
+        return changed
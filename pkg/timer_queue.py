@@ -0,0 +1,167 @@
+"""
+ConBee adapter for Mozilla IoT Gateway.
+Heap of timers owning all delayed and periodic work of the adapter: polls,
+ramp steps, write windows, reconnect backoff. One io loop handle is armed
+for the earliest timer, so the number of threads and wakeups does not grow
+with the number of devices.
+"""
+import heapq
+import itertools
+import logging
+import random
+import time
+
+from metrics import Metrics
+
+logger = logging.getLogger('conbee.timer')
+
+# Seconds a timer may fire late before it is reported as overdue
+OVERDUE = 0.5
+# Min seconds between two log lines about overdue timers
+REPORT_INTERVAL = 60
+# Timers due within the clock resolution are fired
+RESOLUTION = time.get_clock_info('monotonic').resolution
+
+
+def jittered(interval, jitter):
+    """ interval +- jitter part of it, e.g. jitter 0.1 gives 0.9 .. 1.1 * interval """
+    if jitter <= 0:
+        return interval
+    return interval * random.uniform(1 - jitter, 1 + jitter)
+
+
+class Timer:
+    __slots__ = ('due', 'func', 'args', 'interval', 'jitter', 'name', 'cancelled')
+
+    def __init__(self, due, func, args, interval, jitter, name):
+        self.due = due
+        self.func = func
+        self.args = args
+        self.interval = interval
+        self.jitter = jitter
+        self.name = name
+        self.cancelled = False
+
+    def cancel(self):
+        """ Safe to call from any thread """
+        self.cancelled = True
+
+
+class TimerQueue:
+    """
+    Timers in a heap ordered by due time. Timers can be added and
+    cancelled from any thread. The functions run in the io loop.
+    """
+
+    def __init__(self, io, metrics=None):
+        """
+        io -- the IoLoop running the timers
+        metrics -- Metrics for lateness and overdue timers
+        """
+        self.io = io
+        self.metrics = metrics or Metrics()
+        self.heap = []
+        self.seq = itertools.count()
+        self.handle = None
+        self.handle_due = None
+        self.counters = {'fired': 0, 'wakeups': 0, 'overdue': 0}
+        self.overdue = {}       # name -> number of overdue since last report
+        self.last_report = 0
+
+    def call_later(self, delay, func, *args, name=None, jitter=0.0):
+        """ Run func(*args) once after delay seconds. Returns the Timer """
+        timer = Timer(self.io.loop.time() + jittered(delay, jitter), func, args, None, jitter,
+                      name or func.__name__)
+        self.push(timer)
+        return timer
+
+    def call_every(self, interval, func, *args, name=None, jitter=0.1):
+        """
+        Run func(*args) every interval seconds, first time after one interval.
+        jitter -- each interval is varied by this part, so timers started
+                  at the same time do not fire in lock-step
+        """
+        timer = Timer(self.io.loop.time() + jittered(interval, jitter), func, args, interval, jitter,
+                      name or func.__name__)
+        self.push(timer)
+        return timer
+
+    def sleep(self, delay):
+        """ Awaitable that is done after delay seconds. Only in coroutines in the io loop """
+        future = self.io.loop.create_future()
+        timer = self.call_later(delay, set_done, future, name='sleep')
+        future.add_done_callback(lambda f: timer.cancel())
+        return future
+
+    def push(self, timer):
+        if self.io.in_loop():
+            self._push(timer)
+        else:
+            self.io.call_soon(self._push, timer)
+
+    def _push(self, timer):
+        heapq.heappush(self.heap, (timer.due, next(self.seq), timer))
+        self.arm()
+
+    def arm(self):
+        """ Arm the io loop handle for the earliest timer """
+        while self.heap and self.heap[0][2].cancelled:
+            heapq.heappop(self.heap)
+        if not self.heap:
+            if self.handle is not None:
+                self.handle.cancel()
+                self.handle = None
+            return
+        due = self.heap[0][0]
+        if self.handle is not None:
+            if self.handle_due <= due:
+                return
+            self.handle.cancel()
+        self.handle_due = due
+        self.handle = self.io.loop.call_at(due, self.run)
+
+    def run(self):
+        """ Fire all timers that are due """
+        self.handle = None
+        self.counters['wakeups'] += 1
+        loop = self.io.loop
+        now = loop.time()
+        while self.heap and self.heap[0][0] <= now + RESOLUTION:
+            due, _, timer = heapq.heappop(self.heap)
+            if timer.cancelled:
+                continue
+            self.counters['fired'] += 1
+            late = max(0.0, now - due)
+            self.metrics.observe('timer.late', late)
+            if late > OVERDUE:
+                self.report_overdue(timer.name, late)
+            if timer.interval is not None:
+                timer.due = due + jittered(timer.interval, timer.jitter)
+                if timer.due <= now:
+                    timer.due = now + jittered(timer.interval, timer.jitter)
+                heapq.heappush(self.heap, (timer.due, next(self.seq), timer))
+            try:
+                timer.func(*timer.args)
+            except Exception as ex:
+                logger.exception('Timer %s failed %s', timer.name, ex)
+        self.arm()
+
+    def report_overdue(self, name, late):
+        self.counters['overdue'] += 1
+        self.metrics.count('timer.overdue')
+        self.overdue[name] = self.overdue.get(name, 0) + 1
+        now = time.monotonic()
+        if now - self.last_report >= REPORT_INTERVAL:
+            logger.warning('Overdue timers. %s was %.3f s late. Since last report: %s', name, late, self.overdue)
+            self.overdue = {}
+            self.last_report = now
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats['pending'] = len(self.heap)
+        return stats
+
+
+def set_done(future):
+    if not future.done():
+        future.set_result(None)
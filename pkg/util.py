@@ -1,6 +1,8 @@
 """Utility functions."""
 
 import colorsys
+import functools
+
 
 def hsv_to_rgb(h, s, v):
     """
@@ -29,3 +31,120 @@ def rgb_to_hsv(rgb):
     r, g, b = tuple(int(rgb[i:i + 2], 16) / 255 for i in range(0, 6, 2))
     h, s, v = colorsys.rgb_to_hsv(r, g, b)
     return (int(h * 360), int(s * 100), int(v * 255))
+
+
+# Color conversion between RGB hex strings and deCONZ xy and hue/sat.
+# Gamma and hue are looked up in tables built once at import, and results
+# for colors seen before are cached, so events and slider drags for many
+# lights do not call colorsys or pow.
+
+# Gamut C of Philips Hue and most other Zigbee color lights. Red, green, blue corners
+GAMUT = ((0.692, 0.308), (0.17, 0.7), (0.153, 0.048))
+# xy of white. Used for black, which has no color
+WHITE_XY = (0.3227, 0.329)
+# Size of the table from linear light to sRGB 0..255
+LINEAR_STEPS = 1024
+
+
+def _to_linear(value):
+    return ((value + 0.055) / 1.055) ** 2.4 if value > 0.04045 else value / 12.92
+
+
+def _from_linear(value):
+    return 1.055 * value ** (1 / 2.4) - 0.055 if value > 0.0031308 else 12.92 * value
+
+
+# sRGB 0..255 -> linear light 0..1
+GAMMA_TO_LINEAR = [_to_linear(i / 255) for i in range(256)]
+# Linear light 0..1 in LINEAR_STEPS steps -> sRGB 0..255
+LINEAR_TO_GAMMA = [int(round(255 * _from_linear(i / (LINEAR_STEPS - 1)))) for i in range(LINEAR_STEPS)]
+# Hue in degrees -> fully saturated r, g, b 0..1
+HUE_TO_RGB = [colorsys.hsv_to_rgb(h / 360, 1, 1) for h in range(360)]
+
+
+def _cross(a, b):
+    return a[0] * b[1] - a[1] * b[0]
+
+
+def _closest_on_line(a, b, p):
+    ab = (b[0] - a[0], b[1] - a[1])
+    t = ((p[0] - a[0]) * ab[0] + (p[1] - a[1]) * ab[1]) / (ab[0] * ab[0] + ab[1] * ab[1])
+    t = min(1.0, max(0.0, t))
+    return (a[0] + ab[0] * t, a[1] + ab[1] * t)
+
+
+def clamp_to_gamut(x, y, gamut=GAMUT):
+    """ Closest xy the light can show """
+    red, green, blue = gamut
+    p = (x, y)
+    v1 = (green[0] - red[0], green[1] - red[1])
+    v2 = (blue[0] - red[0], blue[1] - red[1])
+    q = (x - red[0], y - red[1])
+    s = _cross(q, v2) / _cross(v1, v2)
+    t = _cross(v1, q) / _cross(v1, v2)
+    if s >= 0 and t >= 0 and s + t <= 1:
+        return x, y
+    candidates = [_closest_on_line(red, green, p), _closest_on_line(blue, red, p),
+                  _closest_on_line(green, blue, p)]
+    return min(candidates, key=lambda c: (c[0] - x) ** 2 + (c[1] - y) ** 2)
+
+
+def _linear_to_hex(r, g, b):
+    top = max(r, g, b, 1e-9)
+    if top > 1:
+        r, g, b = r / top, g / top, b / top
+    steps = LINEAR_STEPS - 1
+    r, g, b = (LINEAR_TO_GAMMA[int(max(0.0, c) * steps + 0.5)] for c in (r, g, b))
+    return '#{:02X}{:02X}{:02X}'.format(r, g, b)
+
+
+@functools.lru_cache(maxsize=4096)
+def rgb_to_xy(rgb):
+    """
+    Convert an RGB hex string to deCONZ xy, clamped to the gamut of the light.
+
+    rgb -- RGB hex string, i.e. #123456
+
+    Returns (x, y) with 4 decimals, i.e. (0.3227, 0.329)
+    """
+    rgb = rgb.lstrip('#')
+    r, g, b = (GAMMA_TO_LINEAR[int(rgb[i:i + 2], 16)] for i in range(0, 6, 2))
+    big_x = r * 0.664511 + g * 0.154324 + b * 0.162028
+    big_y = r * 0.283881 + g * 0.668433 + b * 0.047685
+    big_z = r * 0.000088 + g * 0.072310 + b * 0.986039
+    total = big_x + big_y + big_z
+    if total == 0:
+        return WHITE_XY
+    x, y = clamp_to_gamut(big_x / total, big_y / total)
+    return (round(x, 4), round(y, 4))
+
+
+@functools.lru_cache(maxsize=4096)
+def xy_to_rgb(x, y):
+    """
+    Convert deCONZ xy to an RGB hex string at full brightness.
+
+    Returns a hex RGB string, i.e. #123456.
+    """
+    x, y = clamp_to_gamut(x, y)
+    if y <= 0:
+        return '#FFFFFF'
+    big_x = x / y
+    big_z = (1 - x - y) / y
+    r = big_x * 1.656492 - 0.354851 - big_z * 0.255038
+    g = -big_x * 0.707196 + 1.655397 + big_z * 0.036152
+    b = big_x * 0.051713 - 0.121364 + big_z * 1.011530
+    return _linear_to_hex(r, g, b)
+
+
+def hs_to_rgb(hue, sat):
+    """
+    Convert deCONZ hue and sat to an RGB hex string at full brightness.
+
+    hue -- 0..65535
+    sat -- 0..254
+    """
+    full = HUE_TO_RGB[int(round(hue * 360 / 65536)) % 360]
+    s = min(sat, 254) / 254
+    r, g, b = (int(round(255 * (1 - s + s * c))) for c in full)
+    return '#{:02X}{:02X}{:02X}'.format(r, g, b)
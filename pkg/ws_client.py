@@ -1,75 +1,162 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import calendar
 import json
 import logging
+import re
+import time
 
-from tornado.ioloop import IOLoop, PeriodicCallback
-from tornado import gen
 from tornado.websocket import websocket_connect
 
+from diagnostics import DIAGNOSTICS, trace
+
+logger = logging.getLogger('conbee.ws')
+
+# Reconnect delay in seconds. Doubled for every failed attempt
+MIN_BACKOFF = 1
+MAX_BACKOFF = 60
+# Seconds between websocket pings. Connection is closed if no pong within PING_TIMEOUT
+PING_INTERVAL = 20
+PING_TIMEOUT = 10
+
+# Cheap scan of the raw message to drop events for unknown devices before decoding
+RE_EVENT = re.compile(r'"e"\s*:\s*"([^"]*)"')
+RE_RESOURCE = re.compile(r'"r"\s*:\s*"([^"]*)"')
+RE_ID = re.compile(r'"id"\s*:\s*"([^"]*)"')
+
 #def on_msg(msg):
-#    #logging.info(msg)
+#    #logger.info(msg)
 #    #json_msg = json.loads(msg.decode("utf-8"))
 #    json_msg = json.loads(msg)
-#    logging.info(json_msg)
-#    #logging.info('msg: %s', str(json_msg))
+#    logger.info(json_msg)
+#    #logger.info('msg: %s', str(json_msg))
 
 class WsClient(object):
-    def __init__(self, adapter, url, timeout):
-        self.adapter = adapter
+    def __init__(self, gateway, url, timeout, connect=True):
+        """
+        gateway -- the ConBeeGateway. Its io loop runs the WebSocket
+        url -- websocket url of deCONZ
+        timeout -- connect timeout in seconds
+        connect -- False to only dispatch messages given to on_msg, e.g. by tools/replay.py
+        """
+        self.gateway = gateway
         self.url = url
         self.timeout = timeout
-        self.ioloop = IOLoop.instance()
+        self.io = gateway.io
         self.ws = None
-        logging.info('ws init 1')
-        self.connect()
-        logging.info('ws init 2')
-        #PeriodicCallback(self.keep_alive, 20000, io_loop=self.ioloop).start()
-        #PeriodicCallback(self.keep_alive, 20000).start()
-        self.ioloop.start()
-        logging.info('ws init 3')
+        self.active = True
+        self.backoff = MIN_BACKOFF
+        self.metrics = gateway.metrics
+        self.recorder = gateway.recorder
+        logger.info('ws init')
+        self.task = self.io.spawn(self.keep_alive()) if connect else None
+
+    def healthy(self):
+        """ True while connected. Pings close the connection if deCONZ stops answering """
+        return self.ws is not None
 
     def on_msg(self, msg):
-        #logging.info(msg)
-        #json_msg = json.loads(msg.decode("utf-8"))
+        received = time.time()
+        start = time.perf_counter()
+        self.metrics.count('ws.events')
+        if self.recorder is not None:
+            self.recorder.write(received, msg)
+        try:
+            self.dispatch(msg, received)
+        except Exception:
+            self.metrics.count('ws.errors')
+            trace('ws.error', msg)
+            DIAGNOSTICS.dump_on_error('after websocket event error')
+            raise
+        finally:
+            self.metrics.observe('ws.dispatch', time.perf_counter() - start)
+
+    def dispatch(self, msg, received):
+        event = RE_EVENT.search(msg)
+        if event is not None and event.group(1) == 'changed':
+            resource = RE_RESOURCE.search(msg)
+            dev_id = RE_ID.search(msg)
+            if resource is not None and dev_id is not None and \
+                    (resource.group(1), dev_id.group(1)) not in self.gateway.routes:
+                self.metrics.count('ws.dropped')
+                return
         json_msg = json.loads(msg)
-        device = self.adapter.get_device_from_mapping(json_msg['r'], json_msg['id'])
+        if json_msg.get('e') != 'changed' and self.gateway.inventory_event(json_msg):
+            return
+        lag = event_lag(json_msg, received)
+        if lag is not None:
+            self.metrics.observe('ws.lag', lag)
+        device = self.gateway.get_device_from_mapping(json_msg.get('r'), json_msg.get('id'))
         if device is None:
-            logging.info('EVENT : %s', json_msg)
+            trace('ws.unhandled', msg)
+            self.metrics.count('ws.unhandled')
+        elif not device.event_action(json_msg):
+            self.metrics.count('ws.unhandled')
         else:
-            device.event_action(json_msg)
+            self.gateway.poller.policy.event(device, received)
 
-    @gen.coroutine
-    def connect(self):
-        logging.info('trying to connect')
+    async def connect(self):
+        """ Return True if connected """
+        logger.info('trying to connect')
         try:
-            self.ws = yield websocket_connect(self.url, on_message_callback=self.on_msg)
+            self.ws = await websocket_connect(self.url, connect_timeout=self.timeout,
+                                              ping_interval=PING_INTERVAL, ping_timeout=PING_TIMEOUT)
         except Exception as e:
-            logging.exception('connection error %s', e)
-        else:
-            logging.info('connected')
-            self.run()
+            logger.error('connection error %s. Retry in %s s', e, self.backoff)
+            return False
+        logger.info('connected')
+        return True
 
-    @gen.coroutine
-    def run(self):
-        try:
-            logging.info('ws run()')
-            while True:
-                msg = yield self.ws.read_message()
-                logging.debug('run msg: %s', msg)
-                if msg is None:
-                    logging.info('connection closed')
-                    self.ws = None
+    async def run(self):
+        logger.info('ws run()')
+        while True:
+            msg = await self.ws.read_message()
+            if msg is None:
+                logger.info('connection closed')
+                self.ws = None
+                break
+            try:
+                self.on_msg(msg)
+            except Exception as e:
+                logger.exception('event error %s', e)
+
+    async def keep_alive(self):
+        """ Keep the connection up. Reconnect with exponential backoff """
+        while self.active:
+            if await self.connect():
+                self.backoff = MIN_BACKOFF
+                self.gateway.ws_connected()
+                await self.run()
+                self.gateway.ws_disconnected()
+                if not self.active:
                     break
-        except Exception as e:
-            logging.exception('connection error %s', e)
-
-    def keep_alive(self):
-        logging.info('ws keep_alive %s', self.ws)
-        if self.ws is None:
-            self.connect()
-        #else:
-        #    self.ws.write_message("keep alive")
+            await self.io.timers.sleep(self.backoff)
+            self.backoff = min(self.backoff * 2, MAX_BACKOFF)
+        logger.info('ws stopped')
+
+    def close(self):
+        """ Stop at once, also while waiting to reconnect """
+        self.active = False
+        if self.task is not None:
+            self.task.cancel()
+        if self.ws is not None:
+            self.io.call_soon(self.ws.close)
+
+def event_lag(event, received):
+    """ Seconds from state.lastupdated (UTC) in the event until received. None if not known """
+    state = event.get('state')
+    if not state:
+        return None
+    lastupdated = state.get('lastupdated')
+    if not lastupdated or lastupdated == 'none':
+        return None
+    try:
+        sent = calendar.timegm(time.strptime(lastupdated[:19], '%Y-%m-%dT%H:%M:%S'))
+        if lastupdated[19:20] == '.':
+            sent += float(lastupdated[19:])
+    except ValueError:
+        return None
+    return max(0.0, received - sent)
 
 #if __name__ == "__main__":
 #    client = Client("ws://localhost:3000", 5)
@@ -0,0 +1,74 @@
+"""
+ConBee adapter for Mozilla IoT Gateway.
+Append-only recording of the raw websocket messages from deCONZ with the
+time they were received. One line per message: time, tab, message.
+Replayed by tools/replay.py to benchmark the event path with real traffic.
+"""
+import logging
+import os
+
+logger = logging.getLogger('conbee.recorder')
+
+# The recording is moved to <path>.1 when it is larger
+MAX_BYTES = 50 * 1024 * 1024
+# Seconds between flushes of the file buffer
+FLUSH_INTERVAL = 1
+
+
+class WsRecorder:
+    """ Only to be used in the io loop, except close after the loop is stopped """
+
+    def __init__(self, io, path, max_bytes=MAX_BYTES):
+        """
+        io -- the IoLoop flushing the file
+        path -- file name of the recording
+        max_bytes -- size before the recording is moved to <path>.1
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.file = open(path, 'a', encoding='utf-8')
+        self.size = self.file.tell()
+        self.count = 0
+        self.timer = io.timers.call_every(FLUSH_INTERVAL, self.flush, name='ws.record', jitter=0)
+        logger.info('Recording websocket messages to %s', path)
+
+    def write(self, received, msg):
+        """
+        received -- time.time() when the message was received
+        msg -- the message as received
+        """
+        if self.file is None:
+            return
+        line = '{:.3f}\t{}\n'.format(received, msg.replace('\n', ' '))
+        self.file.write(line)
+        self.size += len(line)
+        self.count += 1
+        if self.size >= self.max_bytes:
+            self.rotate()
+
+    def rotate(self):
+        self.file.close()
+        os.replace(self.path, self.path + '.1')
+        self.file = open(self.path, 'a', encoding='utf-8')
+        self.size = 0
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+
+    def close(self):
+        self.timer.cancel()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        logger.info('Recorded %s websocket messages', self.count)
+
+
+def read_recording(path):
+    """ Yield (received, msg) for every message in the recording """
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            received, _, msg = line.rstrip('\n').partition('\t')
+            if msg:
+                yield float(received), msg
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark of the adapter without a ConBee stick.
+
+Starts tools/fake_deconz.py in a subprocess and runs the real ConBeeAdapter,
+WsClient and DeconzRestApi against it. The gateway is replaced by
+tools/fake_gateway.py. Reports:
+  - pairing time, cold or warm from the inventory snapshot of a previous run
+  - event latency: event sent by fake deCONZ -> notify_property_changed
+  - command round trip: Property.set_value -> PUT received by fake deCONZ
+  - echo writes: PUTs to lights not caused by a command, e.g. a reported state sent back
+  - CPU time, RSS and number of threads of the adapter process
+
+    python3 tools/benchmark.py --lights 100 --sensors 100 --rate 200 --duration 20
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TOOLS_DIR))
+sys.path.insert(0, TOOLS_DIR)
+
+import fake_gateway
+sys.modules['gateway_addon'] = fake_gateway
+
+
+def percentiles(values):
+    """ p50, p90, p99 and max in ms """
+    if not values:
+        return 'no samples'
+    values = sorted(values)
+    def pct(p):
+        return 1000 * values[min(len(values) - 1, int(p * len(values)))]
+    return 'n={} p50={:.1f} p90={:.1f} p99={:.1f} max={:.1f} ms'.format(
+        len(values), pct(0.5), pct(0.9), pct(0.99), 1000 * values[-1])
+
+
+def rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def wait_for_port(host, port, timeout=10):
+    end = time.time() + timeout
+    while time.time() < end:
+        try:
+            socket.create_connection((host, port), 0.2).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError('fake deCONZ did not start')
+
+
+def bench_request(base_url, method='GET', data=None):
+    req = urllib.request.Request(base_url + '/bench/log', data=data, method=method)
+    with urllib.request.urlopen(req) as f:
+        return json.loads(f.read().decode('utf-8'))
+
+
+def event_latencies(gateway, sent, notified):
+    """ Match temperature events with the notify_property_changed they caused """
+    sensor_of_device = {uid: dev_id for (res, dev_id), uid in gateway.device_mapping.items() if res == 'sensors'}
+    sent_times = {}
+    for res, dev_id, key, value, when in sent:
+        if res == 'sensors' and key == 'temperature':
+            sent_times[(dev_id, value)] = when
+    latencies = []
+    for uid, name, value, when in notified:
+        if name != 'temperature' or uid not in sensor_of_device:
+            continue
+        # Celsius. TemperatureProperty value is deCONZ value / 100
+        key = (sensor_of_device[uid], int(round(value * 100)))
+        if key in sent_times:
+            latencies.append(when - sent_times.pop(key))
+    return latencies, len(sent_times)
+
+
+def command_round_trips(commands, received):
+    """ Match commands with the first PUT received after it for the same light and value """
+    round_trips = []
+    for dev_id, bri, when in commands:
+        for res, put_id, values, received_at in received:
+            if res == 'lights' and put_id == dev_id and values.get('bri') == bri and received_at >= when:
+                round_trips.append(received_at - when)
+                break
+    return round_trips
+
+
+def unmatched_puts(commands, received):
+    """ PUTs to lights not caused by a command, e.g. events sent back to deCONZ """
+    commanded = {(dev_id, bri) for dev_id, bri, when in commands}
+    return sum(1 for res, put_id, values, received_at in received
+               if res == 'lights' and (put_id, values.get('bri')) not in commanded)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the adapter against fake deCONZ')
+    parser.add_argument('--lights', type=int, default=50)
+    parser.add_argument('--sensors', type=int, default=50)
+    parser.add_argument('--rate', type=float, default=50, help='events per second from fake deCONZ')
+    parser.add_argument('--commands', type=float, default=5, help='property changes per second')
+    parser.add_argument('--duration', type=float, default=10, help='seconds')
+    parser.add_argument('--port', type=int, default=8480)
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--data-dir', help='keep the inventory snapshot here. Run twice for a warm start')
+    parser.add_argument('--record', action='store_true',
+                        help='record the websocket events to events.rec in the data dir. See replay.py')
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level, format='%(filename)s:%(lineno)s %(levelname)s %(message)s')
+
+    host = '127.0.0.1'
+    base_url = 'http://{}:{}'.format(host, args.port)
+    fake = subprocess.Popen([sys.executable, os.path.join(TOOLS_DIR, 'fake_deconz.py'),
+                             '--host', host, '--port', str(args.port), '--ws-port', str(args.port + 1),
+                             '--lights', str(args.lights), '--sensors', str(args.sensors), '--rate', '0'],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(host, args.port)
+        fake_gateway.CONFIG.update({'url': base_url, 'apikey': 'FAKEKEY', 'temperature': 'Celsius',
+                                    'log_level': args.log_level, 'log_levels': args.log_level,
+                                    'record_events': args.record,
+                                    # Every temperature event is matched with its notification
+                                    'notify_policies': {'TemperatureProperty': {}}})
+        fake_gateway.USER_PROFILE['dataDir'] = args.data_dir or tempfile.mkdtemp()
+        from pkg.conbee_adapter import ConBeeAdapter
+
+        cpu_start = cpu_seconds()
+        start = time.time()
+        adapter = ConBeeAdapter()
+        registered = time.time() - start
+        from_snapshot = len(adapter.get_devices())
+        gateway = adapter.gateways[0]
+        gateway.sync_task.result(10)
+        pairing = time.time() - start
+        logging.getLogger().setLevel(args.log_level)
+        while gateway.ws is None or not gateway.ws.healthy():
+            if time.time() - start > 10:
+                raise RuntimeError('websocket did not connect')
+            time.sleep(0.05)
+        time.sleep(1)
+
+        lights = [(dev_id, gateway.get_device_from_mapping('lights', dev_id))
+                  for (res, dev_id) in list(gateway.device_mapping) if res == 'lights']
+        lights = [(dev_id, device) for dev_id, device in lights if device is not None]
+        del fake_gateway.NOTIFIED[:]
+        cpu_run = cpu_seconds()
+        bench_request(base_url, 'PUT', json.dumps({'rate': args.rate}).encode('utf-8'))
+        run_start = time.time()
+        commands = []
+        next_command = run_start
+        while time.time() - run_start < args.duration:
+            if lights and args.commands > 0 and time.time() >= next_command:
+                next_command += 1 / args.commands
+                dev_id, device = random.choice(lights)
+                prop = device.find_property('bri')
+                value = random.randrange(10, 101, 10)
+                if prop is not None and value != prop.get_value():
+                    commands.append((dev_id, prop.prop2dev_value(value), time.time()))
+                    prop.set_value(value)
+            time.sleep(0.005)
+        bench_request(base_url, 'PUT', json.dumps({'rate': 0}).encode('utf-8'))
+        wall = time.time() - run_start
+        cpu_used = cpu_seconds() - cpu_run
+        time.sleep(1)
+        log = bench_request(base_url)
+
+        latencies, missing = event_latencies(gateway, log['sent'], fake_gateway.NOTIFIED)
+        print('devices        lights={} sensors={} paired={}'.format(args.lights, args.sensors,
+                                                                      len(adapter.get_devices())))
+        print('pairing        {:.3f} s (cpu {:.2f} s)'.format(pairing, cpu_run - cpu_start))
+        print('warm start     {} devices in {:.3f} s'.format(from_snapshot, registered))
+        print('events         sent={} rate={:.0f}/s'.format(len(log['sent']), len(log['sent']) / wall))
+        print('event latency  {} (not notified: {})'.format(percentiles(latencies), missing))
+        print('command rtt    {}'.format(percentiles(command_round_trips(commands, log['received']))))
+        print('echo writes    {} (puts not from a command)'.format(
+            unmatched_puts(commands, [put for put in log['received'] if put[3] >= run_start])))
+        print('cpu            {:.2f} s in {:.1f} s ({:.1f}%)'.format(cpu_used, wall, 100 * cpu_used / wall))
+        print('rss            {:.1f} MB'.format(rss_mb()))
+        print('threads        {}'.format(threading.active_count()))
+        for name, histogram in sorted(adapter.metrics.snapshot()['histograms'].items()):
+            print('{:14} {}'.format(name, histogram))
+        print('counters       {}'.format(adapter.metrics.snapshot()['counters']))
+        print('scheduler      {}'.format(gateway.scheduler.stats()))
+        print('writer         {}'.format(gateway.writer.stats()))
+        print('rest pool      {}'.format(gateway.rest.pool_stats()))
+        print('timers         {}'.format(adapter.io.timers.stats()))
+        print('notifier       {}'.format(adapter.notifier.stats()))
+        print('poll intervals {}'.format(gateway.poller.policy.stats()))
+        if gateway.recorder is not None:
+            print('recording      {} events to {}'.format(gateway.recorder.count, gateway.recorder.path))
+        adapter.unload()
+    finally:
+        fake.terminate()
+        fake.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for deCONZ. Serves the REST API and a websocket event feed
+for N lights and N sensors, and sends M events per second.
+Used by benchmark.py. Can also be started by hand to try the adapter:
+
+    python3 tools/fake_deconz.py --lights 50 --sensors 50 --rate 20
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+
+import tornado.web
+import tornado.websocket
+
+API_KEY = 'FAKEKEY'
+
+
+class FakeDeconz:
+    """ State of the fake gateway and log of sent events and received commands """
+
+    def __init__(self, lights, sensors, host, port, ws_port, color_lights=0):
+        self.host = host
+        self.port = port
+        self.ws_port = ws_port
+        self.clients = []
+        self.rate = 0
+        self.seq = 0
+        self.sent = []      # [resource, id, key, value, time] for every event
+        self.received = []  # [resource, id, values, time] for every PUT
+        self.lights = {}
+        self.sensors = {}
+        self.groups = {}
+        for ix in range(1, lights + 1):
+            self.lights[str(ix)] = {
+                'etag': new_etag(), 'name': 'Light {}'.format(ix), 'manufacturername': 'Fake',
+                'modelid': 'Fake CT bulb', 'type': 'Color temperature light', 'swversion': '1.0',
+                'uniqueid': '00:fa:ce:00:00:00:{:02x}:{:02x}-01'.format(ix // 256, ix % 256),
+                'ctmin': 153, 'ctmax': 454, 'hascolor': True,
+                'state': {'on': True, 'bri': 128, 'ct': 300, 'alert': 'none', 'reachable': True}}
+        for ix in range(lights + 1, lights + color_lights + 1):
+            self.lights[str(ix)] = {
+                'etag': new_etag(), 'name': 'Color light {}'.format(ix), 'manufacturername': 'Fake',
+                'modelid': 'Fake color bulb', 'type': 'Extended color light', 'swversion': '1.0',
+                'uniqueid': '00:fa:ce:00:00:00:{:02x}:{:02x}-01'.format(ix // 256, ix % 256),
+                'ctmin': 153, 'ctmax': 500, 'hascolor': True,
+                'state': {'on': True, 'bri': 128, 'ct': 300, 'xy': [0.3227, 0.329], 'hue': 0, 'sat': 0,
+                          'colormode': 'xy', 'alert': 'none', 'reachable': True}}
+        for ix in range(1, sensors + 1):
+            self.sensors[str(ix)] = {
+                'etag': new_etag(), 'name': 'Temperature {}'.format(ix), 'manufacturername': 'Fake',
+                'modelid': 'Fake temperature', 'type': 'ZHATemperature', 'swversion': '1.0',
+                'uniqueid': '00:fa:ce:00:00:01:{:02x}:{:02x}-01-0402'.format(ix // 256, ix % 256),
+                'state': {'temperature': 2000, 'lastupdated': now_str()},
+                'config': {'battery': 100, 'on': True, 'reachable': True}}
+        if self.lights:
+            self.groups['1'] = {'etag': new_etag(), 'name': 'All fake lights', 'type': 'LightGroup',
+                                'hidden': False, 'lights': list(self.lights),
+                                'action': {'on': True, 'bri': 128, 'ct': 300},
+                                'state': {'all_on': True, 'any_on': True}}
+
+    def config(self):
+        return {'name': 'Fake deCONZ', 'ipaddress': self.host, 'websocketport': self.ws_port,
+                'apiversion': '1.16.0', 'swversion': '2.05.00'}
+
+    def full_state(self):
+        return {'config': self.config(), 'lights': self.lights, 'sensors': self.sensors,
+                'groups': self.groups, 'rules': {}, 'schedules': {}}
+
+    def resource(self, resource):
+        return {'lights': self.lights, 'sensors': self.sensors, 'groups': self.groups}.get(resource)
+
+    def change(self, resource, dev_id, section, values):
+        """ Change state and send a websocket event as deCONZ does """
+        data = self.resource(resource)[dev_id]
+        data[section].update(values)
+        data['etag'] = new_etag()
+        event = {'e': 'changed', 'id': dev_id, 'r': resource, 't': 'event', section: values}
+        msg = json.dumps(event)
+        now = time.time()
+        for key, value in values.items():
+            self.sent.append([resource, dev_id, key, value, now])
+        for client in self.clients:
+            client.write_message(msg)
+
+    def put(self, resource, dev_id, values):
+        self.received.append([resource, dev_id, values, time.time()])
+        if resource == 'groups':
+            for light_id in self.groups[dev_id]['lights']:
+                self.change('lights', light_id, 'state', values)
+            self.groups[dev_id]['action'].update(values)
+        else:
+            self.change(resource, dev_id, 'state', values)
+
+    def random_event(self):
+        """ One event. Temperature sensors count up so every event has a new value """
+        self.seq += 1
+        if self.sensors and (not self.lights or self.seq % 2 == 0):
+            dev_id = random.choice(list(self.sensors))
+            temperature = self.sensors[dev_id]['state']['temperature'] + 1
+            self.change('sensors', dev_id, 'state', {'temperature': temperature, 'lastupdated': now_str()})
+        elif self.lights:
+            dev_id = random.choice(list(self.lights))
+            self.change('lights', dev_id, 'state', {'bri': random.randint(1, 254)})
+
+    async def feed(self):
+        """ Send self.rate events per second """
+        next_time = time.monotonic()
+        while True:
+            if self.rate <= 0:
+                await asyncio.sleep(0.1)
+                next_time = time.monotonic()
+                continue
+            next_time += 1 / self.rate
+            self.random_event()
+            await asyncio.sleep(max(0, next_time - time.monotonic()))
+
+
+class RestHandler(tornado.web.RequestHandler):
+    def initialize(self, fake):
+        self.fake = fake
+
+    def get(self, key, resource=None, dev_id=None):
+        if resource is None:
+            data = self.fake.full_state()
+        elif resource == 'config':
+            data = self.fake.config()
+        elif self.fake.resource(resource) is None:
+            raise tornado.web.HTTPError(404)
+        elif dev_id is None:
+            data = self.fake.resource(resource)
+        elif dev_id in self.fake.resource(resource):
+            data = self.fake.resource(resource)[dev_id]
+        else:
+            raise tornado.web.HTTPError(404)
+        self.write(json.dumps(data))
+
+    def put(self, key, resource, dev_id, section):
+        if self.fake.resource(resource) is None or dev_id not in self.fake.resource(resource):
+            raise tornado.web.HTTPError(404)
+        values = json.loads(self.request.body)
+        self.fake.put(resource, dev_id, values)
+        self.write(json.dumps([{'success': {'/{}/{}/{}/{}'.format(resource, dev_id, section, k): v}}
+                               for k, v in values.items()]))
+
+
+class BenchLogHandler(tornado.web.RequestHandler):
+    """ Log of sent events and received commands. Used by benchmark.py """
+    def initialize(self, fake):
+        self.fake = fake
+
+    def get(self):
+        self.write(json.dumps({'sent': self.fake.sent, 'received': self.fake.received}))
+
+    def put(self):
+        """ {"rate": events per second} """
+        self.fake.rate = float(json.loads(self.request.body)['rate'])
+        self.write(json.dumps({'rate': self.fake.rate}))
+
+
+class EventHandler(tornado.websocket.WebSocketHandler):
+    def initialize(self, fake):
+        self.fake = fake
+
+    def open(self):
+        self.fake.clients.append(self)
+
+    def on_close(self):
+        self.fake.clients.remove(self)
+
+
+def new_etag():
+    return '{:032x}'.format(random.getrandbits(128))
+
+
+def now_str():
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime())
+
+
+def start(fake):
+    """ Start the servers and the event feed in the current asyncio loop """
+    args = dict(fake=fake)
+    tornado.web.Application([
+        (r'/bench/log', BenchLogHandler, args),
+        (r'/api/([^/]+)/?', RestHandler, args),
+        (r'/api/([^/]+)/(\w+)/?', RestHandler, args),
+        (r'/api/([^/]+)/(\w+)/(\w+)/?', RestHandler, args),
+        (r'/api/([^/]+)/(\w+)/(\w+)/(\w+)/?', RestHandler, args),
+    ], log_function=lambda handler: None).listen(fake.port, fake.host)
+    tornado.web.Application([(r'/', EventHandler, args)]).listen(fake.ws_port, fake.host)
+    asyncio.ensure_future(fake.feed())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake deCONZ REST API and websocket')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8480)
+    parser.add_argument('--ws-port', type=int, default=8481)
+    parser.add_argument('--lights', type=int, default=10)
+    parser.add_argument('--color-lights', type=int, default=0)
+    parser.add_argument('--sensors', type=int, default=10)
+    parser.add_argument('--rate', type=float, default=10, help='events per second')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    fake = FakeDeconz(args.lights, args.sensors, args.host, args.port, args.ws_port, args.color_lights)
+    fake.rate = args.rate
+
+    async def run():
+        start(fake)
+        logging.info('Fake deCONZ on http://%s:%s/api/%s ws port %s',
+                     args.host, args.port, API_KEY, args.ws_port)
+        await asyncio.Event().wait()
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+In-process stand-in for the gateway_addon package. Lets benchmark.py run
+the real ConBeeAdapter without a Mozilla IoT Gateway. Property changes
+sent to the gateway are recorded with a timestamp.
+
+Install before pkg is imported:
+
+    sys.modules['gateway_addon'] = fake_gateway
+"""
+import time
+
+API_VERSION = 2
+
+# Returned by Database.load_config
+CONFIG = {}
+# Adapter.user_profile. dataDir is where the inventory snapshot is kept
+USER_PROFILE = {}
+# (device id, property name, value, time) for every notify_property_changed
+NOTIFIED = []
+
+
+class Adapter:
+    def __init__(self, _id, package_name, verbose=False):
+        self.id = _id
+        self.package_name = package_name
+        self.verbose = verbose
+        self.devices = {}
+        self.user_profile = dict(USER_PROFILE)
+
+    def get_device(self, device_id):
+        return self.devices.get(device_id)
+
+    def get_devices(self):
+        return self.devices
+
+    def handle_device_added(self, device):
+        self.devices[device.id] = device
+
+    def handle_device_removed(self, device):
+        self.devices.pop(device.id, None)
+
+    def send_error(self, message):
+        print('send_error', message)
+
+    def unload(self):
+        pass
+
+    def close_proxy(self):
+        pass
+
+    def proxy_running(self):
+        return True
+
+
+class Device:
+    def __init__(self, adapter, _id):
+        self.adapter = adapter
+        self.id = _id
+        self.name = ''
+        self.description = ''
+        self.type = ''
+        self._type = []
+        self.properties = {}
+        self.actions = {}
+        self.connected = True
+
+    def find_property(self, property_name):
+        return self.properties.get(property_name)
+
+    def notify_property_changed(self, prop):
+        NOTIFIED.append((self.id, prop.name, prop.value, time.time()))
+
+    def connected_notify(self, connected):
+        self.connected = connected
+
+    def action_notify(self, action):
+        pass
+
+    def as_dict(self):
+        return {'id': self.id, 'name': self.name,
+                'properties': {k: v.description for k, v in self.properties.items()}}
+
+
+class Property:
+    def __init__(self, device, name, description):
+        self.device = device
+        self.name = name
+        self.description = description
+        self.value = None
+
+    def get_value(self):
+        return self.value
+
+    def set_cached_value(self, value):
+        self.value = value
+        return value
+
+    def set_value(self, value):
+        self.set_cached_value(value)
+        self.device.notify_property_changed(self)
+
+    def as_dict(self):
+        return dict(self.description, name=self.name, value=self.value)
+
+
+class Action:
+    def __init__(self, id_, device, name, input_):
+        self.id = id_
+        self.device = device
+        self.name = name
+        self.input = input_
+        self.status = 'created'
+
+    def as_dict(self):
+        return {'id': self.id, 'name': self.name, 'input': self.input, 'status': self.status}
+
+    def start(self):
+        self.status = 'pending'
+
+    def finish(self):
+        self.status = 'completed'
+
+
+class Database:
+    def __init__(self, package_name, path=None):
+        self.package_name = package_name
+
+    def open(self):
+        return True
+
+    def close(self):
+        pass
+
+    def load_config(self):
+        return dict(CONFIG)
+
+    def save_config(self, config):
+        CONFIG.update(config)
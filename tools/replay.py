@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Replay a websocket recording through the event path of the adapter.
+
+Recordings are made by the adapter with the record_events option, or by
+benchmark.py --record. The devices are created from the inventory snapshot
+next to the recording. Nothing is sent to deCONZ. Every message is fed to
+WsClient.on_msg and from there to ConBeeDevice.event_action, in real time
+or as fast as possible. Reports dispatch throughput and cost per event.
+
+    python3 tools/replay.py ~/.mozilla-iot/data/zigbee-conbee-adapter/events.rec --repeat 10
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TOOLS_DIR))
+sys.path.insert(0, TOOLS_DIR)
+
+import fake_gateway
+sys.modules['gateway_addon'] = fake_gateway
+
+from benchmark import cpu_seconds, percentiles
+
+PACKAGE_NAME = 'zigbee-conbee-adapter'
+# Nothing listens here. Commands caused by events fail at once
+NO_DECONZ = 'http://127.0.0.1:9'
+
+
+def copy_inventory(data_dir, work_dir):
+    """
+    Copy the inventory snapshots without the deCONZ config, so no websocket
+    is connected, and the adapter does not overwrite the originals.
+    """
+    target = os.path.join(work_dir, PACKAGE_NAME)
+    os.makedirs(target)
+    for name in os.listdir(data_dir):
+        if name.startswith('inventory') and name.endswith('.json'):
+            with open(os.path.join(data_dir, name)) as f:
+                snapshot = json.load(f)
+            snapshot.pop('config', None)
+            with open(os.path.join(target, name), 'w') as f:
+                json.dump(snapshot, f)
+
+
+async def replay(client, messages, realtime):
+    """ Feed messages to client.on_msg. Returns the cost of every message in seconds """
+    costs = []
+    if not messages:
+        return costs
+    first = messages[0][0]
+    start = time.monotonic()
+    for received, msg in messages:
+        if realtime:
+            delay = (received - first) - (time.monotonic() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        begin = time.perf_counter()
+        try:
+            client.on_msg(msg)
+        except Exception as ex:
+            logging.debug('event error %s', ex)
+        costs.append(time.perf_counter() - begin)
+    return costs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a websocket recording through the adapter')
+    parser.add_argument('recording', help='file written with record_events')
+    parser.add_argument('--data-dir', help='dir with the inventory snapshot. Default the dir of the recording')
+    parser.add_argument('--gateway', type=int, default=1, help='number of the gateway in the config')
+    parser.add_argument('--realtime', action='store_true', help='keep the time between messages')
+    parser.add_argument('--repeat', type=int, default=1, help='replay the recording this many times')
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level, format='%(filename)s:%(lineno)s %(levelname)s %(message)s')
+
+    from pkg.ws_recorder import read_recording
+    messages = list(read_recording(args.recording))
+    work_dir = tempfile.mkdtemp()
+    try:
+        copy_inventory(args.data_dir or os.path.dirname(os.path.abspath(args.recording)), work_dir)
+        gateways = [{'url': NO_DECONZ, 'apikey': 'REPLAY'}] * (args.gateway - 1)
+        fake_gateway.CONFIG.update({'url': NO_DECONZ, 'apikey': 'REPLAY', 'temperature': 'Celsius',
+                                    'log_level': args.log_level, 'log_levels': args.log_level,
+                                    'gateways': gateways})
+        fake_gateway.USER_PROFILE['dataDir'] = work_dir
+        from pkg.conbee_adapter import ConBeeAdapter
+        from pkg.ws_client import WsClient
+
+        adapter = ConBeeAdapter()
+        for gateway in adapter.gateways:
+            gateway.stop()
+        gateway = adapter.gateways[args.gateway - 1]
+        client = WsClient(gateway, None, 0, connect=False)
+
+        cpu_start = cpu_seconds()
+        start = time.perf_counter()
+        costs = []
+        for _ in range(args.repeat):
+            costs += adapter.io.spawn(replay(client, messages, args.realtime)).result()
+        wall = time.perf_counter() - start
+        cpu_used = cpu_seconds() - cpu_start
+
+        counters = adapter.metrics.snapshot()['counters']
+        span = messages[-1][0] - messages[0][0] if messages else 0
+        print('recording      {} messages in {:.1f} s, {} devices'.format(len(messages), span,
+                                                                         len(adapter.get_devices())))
+        print('replayed       {} events in {:.3f} s ({:.0f} events/s)'.format(len(costs), wall,
+                                                                              len(costs) / wall if wall else 0))
+        print('cost per event {} mean={:.1f} us'.format(percentiles(costs),
+                                                        1e6 * sum(costs) / len(costs) if costs else 0))
+        print('cpu            {:.2f} s ({:.1f} us per event)'.format(cpu_used,
+                                                                    1e6 * cpu_used / len(costs) if costs else 0))
+        print('counters       {}'.format({key: value for key, value in sorted(counters.items())
+                                          if key.startswith('ws.')}))
+        adapter.unload()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()